@@ -0,0 +1,303 @@
+# bench.py
+# -*- coding: utf-8 -*-
+"""
+Offline load test for the conversation flows in main.py.
+
+Synthetic users walk every path — /start → language, the products grid with a
+category click and Back, and the full service form up to submit_ticket — through
+Dispatcher.feed_update. The Bot session is mocked: nothing leaves the machine, every
+outbound API call is recorded (and can be given an artificial latency).
+
+Reported (and written as JSON so runs can be compared between commits):
+- throughput (updates/s), p50/p95/p99 latency per handler
+- outbound API calls per user interaction, by method
+- traced memory growth per 10k simulated users
+
+Usage:
+    python bench.py --users 2000 --concurrency 100 --out bench_results.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# State files of the run go to a throwaway directory; must be set before importing main
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="bench-"))
+# Synthetic users tap far faster than people; the per-user flood limit would drop them
+os.environ.setdefault("THROTTLE_RATE", "0")
+# Latencies are measured around feed_update, so handlers must run inside it
+os.environ.setdefault("UPDATE_CONCURRENCY", "0")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, File, InputFile, Message, PhotoSize, Update, User
+
+import main
+from metrics import RequestMetricsMiddleware
+
+BENCH_TOKEN = "42:BENCH"
+USER_ID_BASE = 10_000_000
+
+
+class RecordingSession(BaseSession):
+    """Answers every Bot API call locally and keeps a log of them."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        self.uploads: Dict[str, Tuple[Bot, InputFile]] = {}  # file_id -> what was uploaded under it
+
+    async def close(self) -> None:
+        pass
+
+    async def stream_content(self, url: str, headers=None, timeout: int = 30, chunk_size: int = 65536, raise_for_status: bool = True):
+        """Serves a file uploaded earlier in the run (getFile answers with its file_id as the path)."""
+        file_id = url.rsplit("/", 1)[-1]
+        if file_id not in self.uploads:
+            raise FileNotFoundError(file_id)
+        bot, upload = self.uploads[file_id]
+        async for chunk in upload.read(bot):
+            yield chunk
+
+    def _message(self, bot: Bot, method: TelegramMethod) -> Message:
+        chat_id = getattr(method, "chat_id", None) or 0
+        photo = None
+        if type(method).__name__ == "SendPhoto":
+            file_id = f"bench-photo-{chat_id}"
+            if isinstance(method.photo, InputFile):
+                self.uploads[file_id] = (bot, method.photo)
+            photo = [PhotoSize(file_id=file_id, file_unique_id="u", width=1, height=1)]
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(timezone.utc),
+            chat=Chat(id=chat_id, type="private"),
+            text=getattr(method, "text", None),
+            photo=photo,
+        )
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        returning = method.__returning__
+        candidates = typing.get_args(returning) or (returning,)
+        if Message in candidates:
+            return self._message(bot, method)
+        if File in candidates:
+            return File(file_id=method.file_id, file_unique_id="u", file_path=method.file_id)
+        if User in candidates:
+            return User(id=bot.id, is_bot=True, first_name="bench", username="bench_bot")
+        return True
+
+
+# ========================= SYNTHETIC UPDATES =========================
+_update_ids = itertools.count(1)
+
+
+def user_lang_code(uid: int) -> str:
+    return "ru" if uid % 2 else "uz"
+
+
+def _user(uid: int) -> Dict[str, Any]:
+    # /start picks the language from this; set_language then exercises the override
+    return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "language_code": user_lang_code(uid)}
+
+
+def text_update(uid: int, text: str) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": _user(uid),
+            "text": text,
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]} if text.startswith("/") else {}),
+        },
+    }
+
+
+def callback_update(uid: int, data: str) -> Dict[str, Any]:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(uid),
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": 42, "is_bot": True, "first_name": "bench"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def user_script(uid: int, lang: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """(handler label, raw update) for every path a user can take."""
+    snap = main.current()
+    ui, appliances, regions = snap.i18n[lang], snap.catalog.appliances, snap.catalog.regions
+    appliance = snap.label(lang, appliances[uid % len(appliances)])
+    region = snap.label(lang, regions[uid % len(regions)])
+    return [
+        ("cmd_start", text_update(uid, "/start")),
+        ("set_language", text_update(uid, ui["lang_name"])),
+        ("main_handler:products", text_update(uid, ui["menu_products"])),
+        ("product_click", callback_update(uid, f"prod:{appliances[0]}")),
+        ("product_back", callback_update(uid, "prod_back")),
+        ("main_handler:about", text_update(uid, ui["menu_about"])),
+        ("main_handler:contacts", text_update(uid, ui["menu_contacts"])),
+        ("start_service_flow", text_update(uid, ui["menu_service"])),
+        ("agreed", callback_update(uid, "agree")),
+        ("service:appliance", text_update(uid, appliance)),
+        ("service:region", text_update(uid, region)),
+        ("service:problem", text_update(uid, "Не включается после перепада напряжения")),
+        ("service:phone", text_update(uid, "+998 90 123 45 67")),
+        ("submit_ticket", text_update(uid, "ул. Амира Темура, 1, кв. 2")),
+    ]
+
+
+# ========================= RUNNER =========================
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+async def run_users(dp, bot: Bot, users: int, concurrency: int, first_uid: int) -> Dict[str, List[float]]:
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one_user(uid: int) -> None:
+        async with sem:
+            for step, raw in user_script(uid, user_lang_code(uid)):
+                update = Update.model_validate(raw, context={"bot": bot})
+                t0 = time.perf_counter()
+                await dp.feed_update(bot, update)
+                latencies[step].append(time.perf_counter() - t0)
+
+    await asyncio.gather(*(one_user(first_uid + i) for i in range(users)))
+    return latencies
+
+
+async def bench(users: int, concurrency: int, latency_ms: float, memory_users: int) -> Dict[str, Any]:
+    session = RecordingSession(latency=latency_ms / 1000)
+    session.middleware(RequestMetricsMiddleware())  # production has it on too
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    dp = main.create_dispatcher()
+
+    # Warm-up (imports, pydantic schema build, SQLite files)
+    await run_users(dp, bot, 10, 10, USER_ID_BASE - 100)
+    session.calls.clear()
+
+    t0 = time.perf_counter()
+    latencies = await run_users(dp, bot, users, concurrency, USER_ID_BASE)
+    elapsed = time.perf_counter() - t0
+    calls = dict(session.calls)
+    interactions = sum(len(v) for v in latencies.values())
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await run_users(dp, bot, memory_users, concurrency, USER_ID_BASE + users)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    await main.storage.close()
+    await main.outbox.close()
+    await main.tickets.close()
+    await main.broadcasts.close()
+
+    handlers = {}
+    for step, values in sorted(latencies.items()):
+        values.sort()
+        handlers[step] = {
+            "count": len(values),
+            "p50_ms": round(_percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(values, 0.99) * 1000, 3),
+        }
+    all_values = sorted(itertools.chain.from_iterable(latencies.values()))
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "params": {"users": users, "concurrency": concurrency, "api_latency_ms": latency_ms, "memory_users": memory_users},
+        "throughput_updates_per_s": round(interactions / elapsed, 1),
+        "elapsed_s": round(elapsed, 3),
+        "latency_ms": {
+            "p50": round(_percentile(all_values, 0.50) * 1000, 3),
+            "p95": round(_percentile(all_values, 0.95) * 1000, 3),
+            "p99": round(_percentile(all_values, 0.99) * 1000, 3),
+        },
+        "handlers": handlers,
+        "api_calls": calls,
+        "api_calls_per_interaction": round(sum(calls.values()) / interactions, 3),
+        "memory_growth_per_10k_users_kb": round((after - before) / 1024 * 10_000 / max(memory_users, 1), 1),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        base = json.load(f)
+    print(f"\nvs {baseline_path} ({base.get('commit')}):")
+    rows = [
+        ("throughput_updates_per_s", current["throughput_updates_per_s"], base["throughput_updates_per_s"]),
+        ("p99_ms", current["latency_ms"]["p99"], base["latency_ms"]["p99"]),
+        ("api_calls_per_interaction", current["api_calls_per_interaction"], base["api_calls_per_interaction"]),
+        ("memory_growth_per_10k_users_kb", current["memory_growth_per_10k_users_kb"], base["memory_growth_per_10k_users_kb"]),
+    ]
+    for name, now, then in rows:
+        change = (now - then) / then * 100 if then else 0.0
+        print(f"  {name:32} {then:>10} → {now:>10} ({change:+.1f}%)")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="simulated Bot API round trip")
+    parser.add_argument("--memory-users", type=int, default=2000, help="users simulated for the memory measurement")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    result = asyncio.run(bench(args.users, args.concurrency, args.api_latency_ms, args.memory_users))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(json.dumps({k: v for k, v in result.items() if k != "handlers"}, ensure_ascii=False, indent=2))
+    for step, stats in result["handlers"].items():
+        print(f"  {step:24} p50={stats['p50_ms']:>8}ms p95={stats['p95_ms']:>8}ms p99={stats['p99_ms']:>8}ms")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+# boot.py
+# -*- coding: utf-8 -*-
+"""
+Cold-start helpers.
+
+BootTimer records the phases of a start (imports, module setup, each startup
+step) and logs them as one line, plus the time until the first update has been
+handled — the number a user waking a sleeping instance actually feels.
+
+The bot's own getMe answer is cached on disk (per bot id), so a restart does not
+need that round trip before it can take updates; it is refreshed in the
+background. CachedMeBot answers Bot.me() — which polling and Command filters
+await — from that copy.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import User
+
+
+class BootTimer(BaseMiddleware):
+    """Also an outer update middleware: register it innermost to time the first reply."""
+
+    def __init__(self, t0: Optional[float] = None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self._last = self.t0
+        self.phases: List[Tuple[str, float]] = []
+        self._first_update_done = False
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def report(self) -> None:
+        breakdown = ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in self.phases)
+        logging.info("Ready %.0f ms after start (ms: %s)", self.elapsed() * 1000, breakdown)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            if not self._first_update_done:
+                self._first_update_done = True
+                logging.info("First update handled %.0f ms after start", self.elapsed() * 1000)
+
+
+def load_me(path: Path, bot: Bot) -> Optional[User]:
+    try:
+        raw = json.loads(Path(path).read_text(encoding="utf-8"))
+        return User.model_validate(raw[str(bot.id)])
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save_me(path: Path, me: User) -> None:
+    path = Path(path)
+    try:
+        raw = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raw = {}
+    raw[str(me.id)] = me.model_dump(mode="json", exclude_none=True)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # A temp file of our own: with WORKERS > 1 every process saves at start
+    fd, tmp = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(raw, ensure_ascii=False))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class CachedMeBot(Bot):
+    """Bot whose me() answers from `cached_me` (see use_cached_me) before asking Telegram."""
+
+    cached_me: Optional[User] = None
+
+    async def me(self) -> User:
+        if self.cached_me is None:
+            self.cached_me = await self.get_me()
+        return self.cached_me
+
+
+def use_cached_me(path: Path, bot: CachedMeBot) -> bool:
+    """Prime `bot.me()` from the cache; True when it no longer needs a request."""
+    me = load_me(path, bot)
+    if me is None:
+        return False
+    bot.cached_me = me
+    return True
+
+
+async def refresh_me(path: Path, bot: CachedMeBot) -> User:
+    me = await bot.get_me()
+    bot.cached_me = me
+    save_me(path, me)
+    return me
@@ -0,0 +1,92 @@
+# bot_session.py
+# -*- coding: utf-8 -*-
+"""
+Tuned aiohttp session for the Bot API.
+
+aiogram's default AiohttpSession uses aiohttp defaults: a 100-connection pool,
+15 s keep-alive, 10 s DNS cache and one timeout for every method. SessionProfile
+makes those explicit and configurable (env BOT_API_*). It also sets per-method
+timeouts, so a stuck sendPhoto upload doesn't hold answerCallbackQuery to the
+same limit, and lets the base URL point at a local Bot API server such as
+fake_bot_api.py.
+"""
+
+import os
+from dataclasses import dataclass, field
+from typing import Mapping, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.methods import TelegramMethod
+from aiohttp import ClientTimeout
+
+DEFAULT_METHOD_TIMEOUTS = {
+    "answerCallbackQuery": 10.0,
+    "deleteMessage": 10.0,
+    "sendMessage": 15.0,
+    "editMessageText": 15.0,
+    "editMessageReplyMarkup": 15.0,
+    "sendPhoto": 60.0,
+    "editMessageMedia": 60.0,
+    "sendDocument": 120.0,
+}
+
+
+@dataclass(frozen=True)
+class SessionProfile:
+    pool_size: int = 100  # total connections
+    pool_size_per_host: int = 0  # 0 = no per-host cap (all traffic goes to one host anyway)
+    keepalive_timeout: float = 75.0  # idle seconds before a pooled connection is closed
+    dns_cache_ttl: int = 600
+    connect_timeout: float = 5.0
+    default_timeout: float = 30.0
+    method_timeouts: Mapping[str, float] = field(default_factory=lambda: dict(DEFAULT_METHOD_TIMEOUTS))
+    api_base: Optional[str] = None  # e.g. "http://127.0.0.1:8081" for a local/fake Bot API server
+
+    @classmethod
+    def from_env(cls) -> "SessionProfile":
+        env = os.environ
+        return cls(
+            pool_size=int(env.get("BOT_API_POOL_SIZE", cls.pool_size)),
+            pool_size_per_host=int(env.get("BOT_API_POOL_SIZE_PER_HOST", cls.pool_size_per_host)),
+            keepalive_timeout=float(env.get("BOT_API_KEEPALIVE", cls.keepalive_timeout)),
+            dns_cache_ttl=int(env.get("BOT_API_DNS_TTL", cls.dns_cache_ttl)),
+            connect_timeout=float(env.get("BOT_API_CONNECT_TIMEOUT", cls.connect_timeout)),
+            default_timeout=float(env.get("BOT_API_TIMEOUT", cls.default_timeout)),
+            api_base=env.get("BOT_API_BASE") or None,
+        )
+
+
+class TunedSession(AiohttpSession):
+    def __init__(self, profile: Optional[SessionProfile] = None, **kwargs):
+        profile = profile or SessionProfile()
+        api = TelegramAPIServer.from_base(profile.api_base) if profile.api_base else PRODUCTION
+        super().__init__(api=api, timeout=profile.default_timeout, **kwargs)
+        self.profile = profile
+        self._connector_init.update(
+            limit=profile.pool_size,
+            limit_per_host=profile.pool_size_per_host,
+            keepalive_timeout=profile.keepalive_timeout,
+            ttl_dns_cache=profile.dns_cache_ttl,
+            use_dns_cache=True,
+            enable_cleanup_closed=True,
+        )
+        self._timeouts = {
+            name: ClientTimeout(total=seconds, connect=profile.connect_timeout)
+            for name, seconds in profile.method_timeouts.items()
+        }
+        self._default_timeout = ClientTimeout(total=profile.default_timeout, connect=profile.connect_timeout)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout=None):
+        # An explicit timeout (e.g. from Dispatcher.start_polling) always wins
+        if timeout is None:
+            long_poll = getattr(method, "timeout", None) if method.__api_method__ == "getUpdates" else None
+            if long_poll:
+                # The server holds a long poll open for `timeout` seconds; the client must wait longer
+                timeout = ClientTimeout(
+                    total=self.profile.default_timeout + long_poll, connect=self.profile.connect_timeout
+                )
+            else:
+                timeout = self._timeouts.get(method.__api_method__, self._default_timeout)
+        return await super().make_request(bot, method, timeout=timeout)
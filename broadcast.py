@@ -0,0 +1,595 @@
+# broadcast.py
+# -*- coding: utf-8 -*-
+"""
+Announcements to everyone who has used the bot: user registry + resumable broadcasts.
+
+Registry: RegistryMiddleware records every private-chat user (and their language)
+after each message or button press. Writes are write-behind like storage.py — a
+user is written at most once per `touch_interval` unless their language changes —
+so the hot path only touches a dict.
+
+Broadcasts: a staff command stores one text per language and the job starts as
+'running'. Broadcaster (one per deployment, in the lead process) walks active users
+in user_id order, page by page, and checkpoints the cursor and counters after
+every page, so a restart resumes where it stopped; at most one page can be sent
+twice. Pausing, resuming and cancelling only change the job's status, which the
+sender rereads after every page — that works from any worker process.
+
+Rate: sends take tokens from their own bucket (BROADCAST_RATE, below Telegram's
+~30 msg/s). Every other message this process sends is charged to the same bucket
+without waiting (InteractiveTrafficMiddleware), so replies to users never queue
+behind a broadcast; the broadcast slows down instead. With several worker
+processes, SharedTraffic tallies each one's sends in the database and the lead
+charges the others' to the bucket too — up to two tally intervals late, so
+keep BROADCAST_RATE a few msg/s under the limit. 429 holds the whole
+broadcast back for `retry_after`. Users who blocked the bot are marked inactive
+and skipped from then on, until they write to the bot again.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import User
+
+from catalog import BASE_LANG
+from fanout import TokenBucket
+from metrics import broadcast_messages
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    lang TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,  -- 0 = blocked the bot or account deleted
+    blocked_at REAL  -- when a send last found them blocked; writing after that reactivates
+);
+CREATE INDEX IF NOT EXISTS users_blocked ON users (blocked_at);
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    created_by INTEGER,
+    texts TEXT NOT NULL,  -- JSON: lang -> text
+    status TEXT NOT NULL DEFAULT 'running',  -- running | paused | done | cancelled
+    cursor INTEGER NOT NULL DEFAULT 0,  -- every user_id up to this one has been handled
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS broadcasts_status ON broadcasts (status);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS traffic (
+    worker INTEGER PRIMARY KEY,
+    sent INTEGER NOT NULL,  -- interactive sends since that process started
+    updated_at REAL NOT NULL
+);
+"""
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+
+# Set inside the broadcaster's own sends, so they are not charged twice
+_broadcasting: ContextVar[bool] = ContextVar("broadcasting", default=False)
+
+
+@dataclass
+class Broadcast:
+    id: int
+    created_at: float
+    created_by: Optional[int]
+    texts: Dict[str, str]
+    status: str
+    cursor: int
+    total: int
+    sent: int
+    failed: int
+    blocked: int
+
+    @property
+    def handled(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    def text_for(self, lang: Optional[str]) -> str:
+        return self.texts.get(lang or BASE_LANG) or self.texts[BASE_LANG]
+
+
+_JOB_COLUMNS = "id, created_at, created_by, texts, status, cursor, total, sent, failed, blocked"
+
+
+def _job(row: Optional[tuple]) -> Optional[Broadcast]:
+    if row is None:
+        return None
+    return Broadcast(row[0], row[1], row[2], json.loads(row[3]), *row[4:])
+
+
+class BroadcastStore:
+    """User registry and broadcast jobs in one SQLite (WAL) file, worked on one dedicated thread."""
+
+    def __init__(self, db_path: Path, flush_interval: float = 2.0, touch_interval: float = 3600.0, cache_size: int = 50_000):
+        self.db_path = Path(db_path)
+        self.flush_interval = flush_interval
+        self.touch_interval = touch_interval
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="broadcast")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: Dict[int, Tuple[Optional[str], float]] = {}  # user_id -> (lang, seen at)
+        self._written: "OrderedDict[int, Tuple[Optional[str], float]]" = OrderedDict()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._blocked_since = time.time()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), isolation_level=None, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+            if columns and "blocked_at" not in columns:
+                # Files created before reactivation went by time
+                conn.execute("ALTER TABLE users ADD COLUMN blocked_at REAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._db()))
+
+    # ---- registry ----
+    def seen(self, user_id: int, lang: Optional[str]) -> None:
+        """Record that the user talked to the bot; cheap enough for every update."""
+        now = time.time()
+        last = self._written.get(user_id)
+        if last is not None and last[0] == lang and now - last[1] < self.touch_interval:
+            self._written.move_to_end(user_id)
+            return
+        self._pending[user_id] = (lang, now)
+        if self._timer is None and self._flush_task is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    def _write_users(self, db: sqlite3.Connection, rows: Dict[int, Tuple[Optional[str], float]]) -> None:
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT INTO users (user_id, lang, first_seen, last_seen) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET lang = COALESCE(excluded.lang, lang), "
+                "last_seen = MAX(last_seen, excluded.last_seen), "
+                # Only a message newer than the failed send proves the block is gone
+                "active = CASE WHEN blocked_at IS NULL OR excluded.last_seen > blocked_at THEN 1 ELSE active END",
+                [(user_id, lang, at, at) for user_id, (lang, at) in rows.items()],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    async def flush(self) -> None:
+        try:
+            while self._pending:
+                rows, self._pending = self._pending, {}
+                try:
+                    await self._run(lambda db: self._write_users(db, rows))
+                except Exception:
+                    logging.exception("User registry flush failed, will retry")
+                    self._pending = {**rows, **self._pending}
+                    await asyncio.sleep(self.flush_interval)
+                    continue
+                for user_id, entry in rows.items():
+                    self._written[user_id] = entry
+                    self._written.move_to_end(user_id)
+                while len(self._written) > self.cache_size:
+                    self._written.popitem(last=False)
+        finally:
+            self._flush_task = None
+
+    async def watch_blocked(self, interval: float = 10.0) -> None:
+        """Forget cached users another process has found blocked, so their next message is written.
+
+        The lead's broadcaster does this itself in checkpoint(); worker processes run this loop.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            since = self._blocked_since
+            try:
+                rows = await self._run(
+                    lambda db: db.execute(
+                        "SELECT user_id, blocked_at FROM users WHERE blocked_at > ?", (since,)
+                    ).fetchall()
+                )
+            except Exception:
+                logging.exception("Blocked users check failed")
+                continue
+            for user_id, blocked_at in rows:
+                self._written.pop(user_id, None)
+                self._blocked_since = max(self._blocked_since, blocked_at)
+
+    async def import_users(self, sources: Iterable[Tuple[Path, str]]) -> int:
+        """One-time backfill from older databases; each query yields (user_id, lang) rows.
+
+        Runs only once per registry file; returns how many users were added.
+        """
+        sources = list(sources)
+
+        def backfill(db: sqlite3.Connection) -> int:
+            if db.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone():
+                return 0
+            now = time.time()
+            before = db.total_changes
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for path, sql in sources:
+                    if not Path(path).exists():
+                        continue
+                    src = sqlite3.connect(f"file:{Path(path)}?mode=ro", uri=True)
+                    try:
+                        rows = src.execute(sql).fetchall()
+                    except sqlite3.Error as e:
+                        logging.warning("User import from %s skipped: %s", path, e)
+                        continue
+                    finally:
+                        src.close()
+                    db.executemany(
+                        "INSERT OR IGNORE INTO users (user_id, lang, first_seen, last_seen) VALUES (?, ?, ?, ?)",
+                        [(user_id, lang, now, now) for user_id, lang in rows],
+                    )
+                db.execute("INSERT INTO meta (key, value) VALUES ('imported', ?)", (str(now),))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return db.total_changes - before - 1
+
+        return await self._run(backfill)
+
+    async def record_traffic(self, worker: int, sent: int) -> None:
+        await self._run(
+            lambda db: db.execute(
+                "INSERT INTO traffic (worker, sent, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (worker) DO UPDATE SET sent = excluded.sent, updated_at = excluded.updated_at",
+                (worker, sent, time.time()),
+            )
+        )
+
+    async def traffic(self) -> Dict[int, int]:
+        """worker index -> interactive sends that process has published."""
+        return await self._run(lambda db: dict(db.execute("SELECT worker, sent FROM traffic").fetchall()))
+
+    async def active_users(self) -> int:
+        return await self._run(lambda db: db.execute("SELECT COUNT(*) FROM users WHERE active = 1").fetchone()[0])
+
+    async def recipients(self, after: int, limit: int) -> List[Tuple[int, Optional[str]]]:
+        """Active users with user_id > `after`, in id order."""
+        return await self._run(
+            lambda db: db.execute(
+                "SELECT user_id, lang FROM users WHERE user_id > ? AND active = 1 ORDER BY user_id LIMIT ?",
+                (after, limit),
+            ).fetchall()
+        )
+
+    # ---- jobs ----
+    async def create(self, texts: Dict[str, str], created_by: Optional[int]) -> Tuple[Broadcast, bool]:
+        """Start a broadcast; returns (job, True), or (unfinished job, False) while another one exists."""
+        await self.flush()  # users seen a moment ago are recipients too
+        now = time.time()
+
+        def write(db: sqlite3.Connection) -> Tuple[Broadcast, bool]:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    f"SELECT {_JOB_COLUMNS} FROM broadcasts WHERE status IN ('running', 'paused') ORDER BY id LIMIT 1"
+                ).fetchone()
+                created = row is None
+                if created:
+                    (total,) = db.execute("SELECT COUNT(*) FROM users WHERE active = 1").fetchone()
+                    cur = db.execute(
+                        "INSERT INTO broadcasts (created_at, created_by, texts, total, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        (now, created_by, json.dumps(texts, ensure_ascii=False), total, now),
+                    )
+                    row = db.execute(f"SELECT {_JOB_COLUMNS} FROM broadcasts WHERE id = ?", (cur.lastrowid,)).fetchone()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return _job(row), created
+
+        return await self._run(write)
+
+    async def get(self, job_id: Optional[int] = None) -> Optional[Broadcast]:
+        """The job with `job_id`, or the latest one."""
+        if job_id is None:
+            sql, args = f"SELECT {_JOB_COLUMNS} FROM broadcasts ORDER BY id DESC LIMIT 1", ()
+        else:
+            sql, args = f"SELECT {_JOB_COLUMNS} FROM broadcasts WHERE id = ?", (job_id,)
+        return await self._run(lambda db: _job(db.execute(sql, args).fetchone()))
+
+    async def running(self) -> Optional[Broadcast]:
+        return await self._run(
+            lambda db: _job(
+                db.execute(f"SELECT {_JOB_COLUMNS} FROM broadcasts WHERE status = 'running' ORDER BY id LIMIT 1").fetchone()
+            )
+        )
+
+    async def transition(self, job_id: Optional[int], from_status: Tuple[str, ...], to_status: str) -> Optional[Broadcast]:
+        """Move the job (default: the latest one) from one of `from_status` to `to_status`.
+
+        Returns the updated job, or None when there is no such job in those states.
+        """
+        now = time.time()
+
+        def write(db: sqlite3.Connection) -> Optional[Broadcast]:
+            target = job_id
+            if target is None:
+                row = db.execute("SELECT id FROM broadcasts ORDER BY id DESC LIMIT 1").fetchone()
+                if row is None:
+                    return None
+                target = row[0]
+            marks = ", ".join("?" * len(from_status))
+            cur = db.execute(
+                f"UPDATE broadcasts SET status = ?, updated_at = ? WHERE id = ? AND status IN ({marks})",
+                (to_status, now, target, *from_status),
+            )
+            if not cur.rowcount:
+                return None
+            return _job(db.execute(f"SELECT {_JOB_COLUMNS} FROM broadcasts WHERE id = ?", (target,)).fetchone())
+
+        return await self._run(write)
+
+    async def checkpoint(
+        self, job_id: int, cursor: int, counts: Dict[str, int], blocked_users: List[Tuple[int, float]]
+    ) -> Broadcast:
+        """Save progress after a page and deactivate users who blocked the bot, in one transaction.
+
+        `blocked_users` are (user_id, time of the failed send); a user seen after that stays active.
+        """
+        now = time.time()
+
+        def write(db: sqlite3.Connection) -> Broadcast:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "UPDATE broadcasts SET cursor = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (cursor, counts.get(SENT, 0), counts.get(FAILED, 0), counts.get(BLOCKED, 0), now, job_id),
+                )
+                db.executemany(
+                    "UPDATE users SET active = CASE WHEN last_seen > ? THEN active ELSE 0 END, blocked_at = ? "
+                    "WHERE user_id = ?",
+                    [(at, at, user_id) for user_id, at in blocked_users],
+                )
+                row = db.execute(f"SELECT {_JOB_COLUMNS} FROM broadcasts WHERE id = ?", (job_id,)).fetchone()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return _job(row)
+
+        for user_id, _ in blocked_users:
+            # Writing to the bot again must reach the database to reactivate them
+            self._written.pop(user_id, None)
+        return await self._run(write)
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+
+        def close(db: sqlite3.Connection) -> None:
+            db.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await self._run(close)
+        self._executor.shutdown(wait=True)
+
+
+class RegistryMiddleware(BaseMiddleware):
+    """Outer message/callback middleware; records private-chat users once their update is handled."""
+
+    def __init__(self, store: BroadcastStore, lang_of: Callable[[User], Optional[str]]):
+        self.store = store
+        self.lang_of = lang_of
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            user = data.get("event_from_user")
+            chat = data.get("event_chat")
+            # After the handler, so a language just picked is the one recorded
+            if user is not None and chat is not None and chat.type == "private" and not user.is_bot:
+                self.store.seen(user.id, self.lang_of(user))
+
+
+class SharedTraffic:
+    """Interactive sends of every worker process, so the lead's broadcast pays for all of them."""
+
+    def __init__(self, store: BroadcastStore, worker: int, interval: float = 1.0):
+        self.store = store
+        self.worker = worker
+        self.interval = interval
+        self.sent = 0
+        self._published = 0
+        self._charged: Optional[Dict[int, int]] = None  # other worker -> sends already charged
+
+    def count(self) -> None:
+        self.sent += 1
+
+    def _new_sends(self, tally: Dict[int, int]) -> int:
+        if self._charged is None:
+            # Everything before the lead (re)started is history
+            self._charged = {w: n for w, n in tally.items() if w != self.worker}
+            return 0
+        new = 0
+        for worker, sent in tally.items():
+            if worker == self.worker:
+                continue
+            last = self._charged.get(worker, 0)
+            new += sent - last if sent >= last else sent  # a restarted worker counts from 0 again
+            self._charged[worker] = sent
+        return new
+
+    async def run(self, bucket: Optional[TokenBucket] = None) -> None:
+        """Publish this process's count; with `bucket` (the lead), charge the other processes' sends to it."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                sent = self.sent
+                if sent != self._published:
+                    await self.store.record_traffic(self.worker, sent)
+                    self._published = sent
+                if bucket is not None:
+                    new = self._new_sends(await self.store.traffic())
+                    if new:
+                        bucket.take(new)
+            except Exception:
+                logging.exception("Traffic tally failed")
+
+
+class InteractiveTrafficMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: every message sent outside a broadcast uses up broadcast tokens."""
+
+    METHODS = ("send", "copy", "forward")
+
+    def __init__(self, bucket: TokenBucket, traffic: Optional[SharedTraffic] = None):
+        self.bucket = bucket
+        self.traffic = traffic
+
+    async def __call__(self, make_request, bot, method):
+        if not _broadcasting.get() and method.__api_method__.startswith(self.METHODS):
+            self.bucket.take()
+            if self.traffic is not None:
+                self.traffic.count()
+        return await make_request(bot, method)
+
+
+class Broadcaster:
+    def __init__(
+        self,
+        store: BroadcastStore,
+        rate: float = 25.0,
+        page_size: int = 50,
+        poll_interval: float = 5.0,
+        max_attempts: int = 5,
+    ):
+        self.store = store
+        self.page_size = page_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate, rate)
+        self._wake = asyncio.Event()
+        self._idle = asyncio.Event()  # clear while a page is being sent
+        self._idle.set()
+        self._stopping = False
+        self._blocked_at: Dict[int, float] = {}  # this page: user_id -> when the send found them blocked
+
+    def wake(self) -> None:
+        """Look for a running job now instead of at the next poll (same process only)."""
+        self._wake.set()
+
+    async def _send(self, bot: Bot, user_id: int, text: str) -> str:
+        _broadcasting.set(True)  # this task only
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=user_id, text=text)
+                return SENT
+            except TelegramRetryAfter as e:
+                # Flood control is per bot: hold back the whole broadcast, not just this user
+                logging.warning("Broadcast hit flood control, pausing %ss", e.retry_after)
+                self.bucket.penalize(e.retry_after)
+            except TelegramForbiddenError:
+                self._blocked_at[user_id] = time.time()
+                return BLOCKED
+            except TelegramBadRequest as e:
+                if "chat not found" in e.message.lower():
+                    self._blocked_at[user_id] = time.time()
+                    return BLOCKED
+                logging.warning("Broadcast to %s rejected: %s", user_id, e.message)
+                return FAILED
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+                logging.warning("Broadcast to %s failed (%s), attempt %s", user_id, e, attempt)
+                await asyncio.sleep(min(30.0, 2.0 ** attempt))
+        return FAILED
+
+    async def _work(self, bot: Bot, job: Broadcast) -> None:
+        logging.info("Broadcast #%s running from user %s (%s/%s done)", job.id, job.cursor, job.handled, job.total)
+        while job.status == "running" and not self._stopping:
+            users = await self.store.recipients(job.cursor, self.page_size)
+            if not users:
+                job = await self.store.transition(job.id, ("running",), "done") or job
+                logging.info("Broadcast #%s finished: %s sent, %s blocked, %s failed", job.id, job.sent, job.blocked, job.failed)
+                return
+            self._idle.clear()
+            try:
+                results = await asyncio.gather(*(self._send(bot, user_id, job.text_for(lang)) for user_id, lang in users))
+                counts: Dict[str, int] = {}
+                for result in results:
+                    counts[result] = counts.get(result, 0) + 1
+                    broadcast_messages.inc(result)
+                blocked = [(user_id, self._blocked_at.pop(user_id)) for user_id in list(self._blocked_at)]
+                # Rereads the status too, so pause/cancel from any process stops us here
+                job = await self.store.checkpoint(job.id, users[-1][0], counts, blocked)
+            finally:
+                self._idle.set()
+        logging.info("Broadcast #%s %s at %s/%s", job.id, job.status, job.handled, job.total)
+
+    async def run(self, bot: Bot) -> None:
+        while not self._stopping:
+            self._wake.clear()
+            try:
+                job = await self.store.running()
+                if job is not None:
+                    await self._work(bot, job)
+                    continue
+            except Exception:
+                logging.exception("Broadcast iteration failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Let the page being sent finish and be checkpointed, so a restart doesn't repeat it."""
+        self._stopping = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Broadcast page still sending at shutdown; it will be repeated on the next start")
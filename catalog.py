@@ -0,0 +1,222 @@
+# catalog.py
+# -*- coding: utf-8 -*-
+"""
+Catalog data (texts, products, regions, staff chats) loaded from catalog.json.
+
+`load_catalog()` validates the file and returns an immutable Catalog. CatalogWatcher
+polls the file and, when it changes, loads and validates the new version off the
+event loop before handing it over. A broken file is logged and ignored, so the
+running catalog always stays valid.
+
+Canonical names (products, regions) are the RU labels; `labels` holds their
+translations per language, missing translations fall back to RU.
+
+More languages can be added without touching catalog.json: `locales/<lang>.json`
+next to it holds {"i18n": {...texts}, "labels": {...}, "language_codes": [...]}.
+`language_codes` maps Telegram's `language_code` of a user (e.g. "kk", "uz-Latn")
+to a catalog language; every language matches its own code.
+"""
+
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from dataclasses import dataclass, field
+from keyword import iskeyword
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional, Tuple
+
+BASE_LANG = "ru"
+LOCALES_DIR = "locales"  # relative to catalog.json
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def _normalize_code(code: str) -> str:
+    return code.lower().replace("_", "-")
+
+
+@dataclass(frozen=True)
+class Catalog:
+    i18n: Mapping[str, Mapping[str, str]]  # lang -> key -> text
+    labels: Mapping[str, Mapping[str, str]]  # lang -> RU name -> translation
+    product_links: Mapping[str, str]  # RU name -> URL
+    staff_by_region: Mapping[str, Tuple[int, ...]]  # RU region -> chat ids
+    appliances: Tuple[str, ...]
+    regions: Tuple[str, ...]
+    urgent_keywords: Tuple[str, ...] = ()  # casefolded; a ticket mentioning one skips digests
+    language_codes: Mapping[str, str] = field(default_factory=lambda: MappingProxyType({}))  # Telegram language_code -> lang
+
+    @property
+    def languages(self) -> Tuple[str, ...]:
+        return tuple(self.i18n)
+
+    def label(self, lang: str, ru_label: str) -> str:
+        return self.labels.get(lang, {}).get(ru_label, ru_label)
+
+    def is_urgent(self, text: str) -> bool:
+        folded = text.casefold()
+        return any(word in folded for word in self.urgent_keywords)
+
+    def language_for(self, code: Optional[str]) -> Optional[str]:
+        """Catalog language for a Telegram `language_code` ("uz", "ru-RU", ...), None if unsupported."""
+        if not code:
+            return None
+        code = _normalize_code(code)
+        return self.language_codes.get(code) or self.language_codes.get(code.split("-", 1)[0])
+
+
+def compile_texts(catalog: Catalog) -> Dict[str, Any]:
+    """One frozen bundle per language: a namedtuple with a field per text key.
+
+    `texts.ask_phone` is a tuple slot read instead of two dict lookups per string;
+    keys missing in a language fail at load time (parse_catalog), not in a handler.
+    """
+    Texts = namedtuple("Texts", sorted(catalog.i18n[BASE_LANG]))
+    return {lang: Texts(**{key: texts[key] for key in Texts._fields}) for lang, texts in catalog.i18n.items()}
+
+
+def _frozen(mapping: dict) -> Mapping:
+    return MappingProxyType(dict(mapping))
+
+
+def parse_catalog(raw: dict) -> Catalog:
+    if not isinstance(raw, dict):
+        raise CatalogError("catalog must be a JSON object")
+    i18n = raw.get("i18n")
+    if not isinstance(i18n, dict) or BASE_LANG not in i18n:
+        raise CatalogError(f"i18n must contain the base language {BASE_LANG!r}")
+    required = set(i18n[BASE_LANG])
+    # Keys become attribute names of the text bundles built by compile_texts()
+    bad_keys = [k for k in required if not k.isidentifier() or k.startswith("_") or iskeyword(k)]
+    if bad_keys:
+        raise CatalogError(f"i18n keys must be identifiers: {', '.join(sorted(bad_keys))}")
+    for lang, texts in i18n.items():
+        if not isinstance(texts, dict):
+            raise CatalogError(f"i18n.{lang} must be an object")
+        missing = required - set(texts)
+        if missing:
+            raise CatalogError(f"i18n.{lang} is missing keys: {', '.join(sorted(missing))}")
+        bad = [k for k, v in texts.items() if not isinstance(v, str) or not v]
+        if bad:
+            raise CatalogError(f"i18n.{lang} has empty or non-text values: {', '.join(bad)}")
+
+    products = raw.get("products")
+    if not isinstance(products, dict) or not products:
+        raise CatalogError("products must be a non-empty object of name -> URL")
+    for name, url in products.items():
+        if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+            raise CatalogError(f"products.{name}: not an http(s) URL: {url!r}")
+        if len(f"prod:{name}".encode()) > 64:
+            raise CatalogError(f"products.{name}: name too long for callback data (64 bytes)")
+
+    staff = raw.get("staff_by_region")
+    if not isinstance(staff, dict) or not staff:
+        raise CatalogError("staff_by_region must be a non-empty object of region -> [chat_id, ...]")
+    for region, chat_ids in staff.items():
+        if not isinstance(chat_ids, list) or not all(isinstance(c, int) and not isinstance(c, bool) for c in chat_ids):
+            raise CatalogError(f"staff_by_region.{region} must be a list of integer chat ids")
+
+    labels = raw.get("labels", {})
+    if not isinstance(labels, dict) or not all(isinstance(v, dict) for v in labels.values()):
+        raise CatalogError("labels must be an object of lang -> {RU name: translation}")
+
+    urgent = raw.get("urgent_keywords", [])
+    if not isinstance(urgent, list) or not all(isinstance(w, str) and w.strip() for w in urgent):
+        raise CatalogError("urgent_keywords must be a list of non-empty strings")
+
+    codes = raw.get("language_codes", {})
+    if not isinstance(codes, dict) or not all(
+        isinstance(v, list) and all(isinstance(c, str) and c for c in v) for v in codes.values()
+    ):
+        raise CatalogError("language_codes must be an object of lang -> [Telegram language_code, ...]")
+    unknown = set(codes) - set(i18n)
+    if unknown:
+        raise CatalogError(f"language_codes for languages without texts: {', '.join(sorted(unknown))}")
+    language_codes = {lang: lang for lang in i18n}
+    for lang, aliases in codes.items():
+        for code in aliases:
+            language_codes.setdefault(_normalize_code(code), lang)
+
+    return Catalog(
+        i18n=_frozen({lang: _frozen(texts) for lang, texts in i18n.items()}),
+        labels=_frozen({lang: _frozen(m) for lang, m in labels.items()}),
+        product_links=_frozen(products),
+        staff_by_region=_frozen({region: tuple(ids) for region, ids in staff.items()}),
+        appliances=tuple(products),
+        regions=tuple(staff),
+        urgent_keywords=tuple(w.strip().casefold() for w in urgent),
+        language_codes=_frozen(language_codes),
+    )
+
+
+def _read_json(path: Path) -> dict:
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        raise CatalogError(f"cannot read {path}: {e}") from e
+
+
+def _locale_files(path: Path) -> Tuple[Path, ...]:
+    return tuple(sorted((Path(path).parent / LOCALES_DIR).glob("*.json")))
+
+
+def merge_locale(raw: dict, lang: str, locale: dict) -> None:
+    """Add one `locales/<lang>.json` to the raw catalog in place."""
+    if not isinstance(locale, dict) or not isinstance(locale.get("i18n"), dict):
+        raise CatalogError(f"{LOCALES_DIR}/{lang}.json must be an object with an i18n object")
+    i18n: Dict[str, dict] = raw.setdefault("i18n", {})
+    if lang in i18n:
+        raise CatalogError(f"language {lang!r} is defined both in the catalog and in {LOCALES_DIR}/")
+    i18n[lang] = locale["i18n"]
+    if "labels" in locale:
+        raw.setdefault("labels", {})[lang] = locale["labels"]
+    if "language_codes" in locale:
+        raw.setdefault("language_codes", {})[lang] = locale["language_codes"]
+
+
+def load_catalog(path: Path) -> Catalog:
+    raw = _read_json(path)
+    if isinstance(raw, dict):
+        for locale_path in _locale_files(path):
+            merge_locale(raw, locale_path.stem, _read_json(locale_path))
+    return parse_catalog(raw)
+
+
+class CatalogWatcher:
+    def __init__(self, path: Path, on_change: Callable[[Catalog], Optional[Awaitable[None]]], interval: float = 5.0):
+        self.path = Path(path)
+        self.on_change = on_change
+        self.interval = interval
+        self._seen = self._fingerprint()
+
+    def _fingerprint(self) -> Optional[Tuple]:
+        try:
+            # Adding, editing or removing a locale file counts as a change too
+            return tuple(
+                (str(p), st.st_mtime_ns, st.st_size)
+                for p in (self.path, *_locale_files(self.path))
+                for st in (p.stat(),)
+            )
+        except OSError:
+            return None
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            fp = self._fingerprint()
+            if fp is None or fp == self._seen:
+                continue
+            self._seen = fp
+            try:
+                catalog = await asyncio.to_thread(load_catalog, self.path)
+            except CatalogError as e:
+                logging.error("Catalog reload rejected, keeping the current one: %s", e)
+                continue
+            result = self.on_change(catalog)
+            if asyncio.iscoroutine(result):
+                await result
+            logging.info("Catalog reloaded from %s", self.path)
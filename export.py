@@ -0,0 +1,178 @@
+# export.py
+# -*- coding: utf-8 -*-
+"""
+Streaming ticket export (CSV or gzip JSONL) for reports.
+
+Rows flow through generators — SQLite cursor → labelled dicts → encoded lines →
+file — so memory stays constant however many tickets match. Region and appliance
+names are translated with the catalog labels of the chosen language. The export
+is blocking I/O; the bot runs it in a worker thread (asyncio.to_thread).
+
+CLI:
+    python export.py --from 2026-10-01 --to 2026-10-07 --region Фергана --lang uz \\
+        --format jsonl --out week.jsonl.gz
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from catalog import BASE_LANG, Catalog, load_catalog
+from tickets import COLUMNS, Ticket
+
+FIELDS = (
+    "id", "created_at", "region", "appliance", "problem", "phone", "address",
+    "status", "urgent", "duplicate_of", "user_id", "username", "full_name", "lang",
+)
+FORMATS = {"csv": ".csv", "jsonl": ".jsonl.gz"}
+# Spreadsheets evaluate a cell starting with these as a formula; user text must stay text
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def iter_tickets(
+    db_path: Path, since: Optional[float] = None, until: Optional[float] = None, region: Optional[str] = None
+) -> Iterator[Ticket]:
+    """Tickets created in [since, until), oldest first, read lazily from the cursor."""
+    if not Path(db_path).exists():
+        return  # nothing submitted yet
+    where, args = [], []
+    if since is not None:
+        where.append("created_at >= ?")
+        args.append(since)
+    if until is not None:
+        where.append("created_at < ?")
+        args.append(until)
+    if region:
+        where.append("region = ?")
+        args.append(region)
+    sql = f"SELECT {COLUMNS} FROM tickets"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at"
+    conn = sqlite3.connect(f"file:{Path(db_path)}?mode=ro", uri=True)
+    try:
+        for row in conn.execute(sql, args):
+            yield Ticket(*row)
+    finally:
+        conn.close()
+
+
+def labelled(tickets: Iterable[Ticket], catalog: Catalog, lang: str) -> Iterator[Dict[str, Any]]:
+    for t in tickets:
+        yield {
+            "id": t.id,
+            "created_at": datetime.fromtimestamp(t.created_at).isoformat(timespec="seconds"),
+            "region": catalog.label(lang, t.region),
+            "appliance": catalog.label(lang, t.appliance),
+            "problem": t.problem,
+            "phone": t.phone,
+            "address": t.address,
+            "status": t.status,
+            "urgent": int(t.urgent),
+            "duplicate_of": t.duplicate_of,
+            "user_id": t.user_id,
+            "username": t.username,
+            "full_name": t.full_name,
+            "lang": t.lang,
+        }
+
+
+def defused(value: Any) -> Any:
+    """Prefix a formula-like string with `'` (so a `+998…` phone shows as `'+998…`)."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=FIELDS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow({k: defused(v) for k, v in record.items()})
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def jsonl_lines(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def export_tickets(
+    db_path: Path,
+    out_path: Path,
+    catalog: Catalog,
+    fmt: str = "csv",
+    lang: str = BASE_LANG,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    region: Optional[str] = None,
+) -> int:
+    """Write matching tickets to `out_path`; returns how many were written."""
+    count = 0
+
+    def counted(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    records = counted(labelled(iter_tickets(db_path, since, until, region), catalog, lang))
+    if fmt == "csv":
+        # BOM so Excel opens the Cyrillic columns correctly
+        with open(out_path, "w", encoding="utf-8-sig", newline="") as f:
+            f.writelines(csv_lines(records))
+    elif fmt == "jsonl":
+        with gzip.open(out_path, "wt", encoding="utf-8") as f:
+            f.writelines(jsonl_lines(records))
+    else:
+        raise ValueError(f"unknown export format {fmt!r}")
+    return count
+
+
+def day_start(day: date) -> float:
+    return time.mktime(day.timetuple())
+
+
+def date_range(start: Optional[str], end: Optional[str], default_days: int = 7):
+    """(since, until) timestamps for inclusive YYYY-MM-DD dates; defaults to the last week."""
+    last = date.fromisoformat(end) if end else date.today()
+    first = date.fromisoformat(start) if start else last - timedelta(days=default_days - 1)
+    return day_start(first), day_start(last + timedelta(days=1))
+
+
+def main_cli() -> None:
+    here = Path(__file__).parent
+    data_dir = Path(os.getenv("DATA_DIR", here / "data"))  # same default as main.py
+    parser = argparse.ArgumentParser(description="Export tickets as CSV or gzip JSONL")
+    parser.add_argument("--db", default=str(data_dir / "tickets.sqlite3"))
+    parser.add_argument("--catalog", default=str(here / "catalog.json"))
+    parser.add_argument("--from", dest="start", help="first day, YYYY-MM-DD (default: 6 days before --to)")
+    parser.add_argument("--to", dest="end", help="last day, YYYY-MM-DD (default: today)")
+    parser.add_argument("--region", help="RU region name")
+    parser.add_argument("--lang", default=BASE_LANG)
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--out", help="output file (default: tickets_<from>_<to><ext>)")
+    args = parser.parse_args()
+
+    since, until = date_range(args.start, args.end)
+    out = args.out or "tickets_{}_{}{}".format(
+        date.fromtimestamp(since).isoformat(), date.fromtimestamp(until - 1).isoformat(), FORMATS[args.format]
+    )
+    count = export_tickets(Path(args.db), Path(out), load_catalog(Path(args.catalog)), args.format, args.lang, since, until, args.region)
+    print(f"{count} tickets → {out}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,262 @@
+# fake_bot_api.py
+# -*- coding: utf-8 -*-
+"""
+Local fake Telegram Bot API server for offline end-to-end and replay testing.
+
+Speaks enough of the API to run main.py unchanged against it (point the bot at it
+with BOT_API_BASE=http://127.0.0.1:8081):
+getMe, getUpdates (long polling), sendMessage, sendPhoto, sendDocument,
+editMessageText/ReplyMarkup/Media, deleteMessage, answerCallbackQuery,
+answerInlineQuery, setWebhook, deleteWebhook.
+
+Fault injection: fixed latency + jitter per call, and a probability of answering
+429 with retry_after — to exercise connection reuse and retry paths.
+
+Control endpoints:
+    POST /_control/config   {"latency_ms", "jitter_ms", "rate_429", "retry_after"}
+    POST /_control/updates  raw Update dicts, or {"user_id", "text"} / {"user_id", "data"}
+    GET  /_control/stats    calls per method, 429s, TCP connections, last sent messages
+
+Usage:
+    python fake_bot_api.py --port 8081 --latency-ms 40 --rate-429 0.02 --replay updates.jsonl
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 4242, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+
+class FakeBotAPI:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, rate_429: float = 0.0, retry_after: int = 1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.errors_429 = 0
+        self.sent: deque = deque(maxlen=1000)
+        self._transports = set()
+        self.connections = 0
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._new_updates = asyncio.Condition()
+        self._methods: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+            "getme": lambda p: BOT_USER,
+            "sendmessage": self._send_message,
+            "sendphoto": self._send_photo,
+            "senddocument": self._send_document,
+            "editmessagetext": self._edit_message,
+            "editmessagereplymarkup": self._edit_message,
+            "editmessagemedia": self._edit_message,
+            "deletemessage": lambda p: True,
+            "answercallbackquery": lambda p: True,
+            "answerinlinequery": lambda p: True,
+            "setwebhook": lambda p: True,
+            "deletewebhook": lambda p: True,
+        }
+
+    # ---------------- updates ----------------
+    async def push_update(self, update: Dict[str, Any]) -> None:
+        if "update_id" not in update:
+            update = {"update_id": next(self._update_ids), **update}
+        async with self._new_updates:
+            self._updates.append(update)
+            self._new_updates.notify_all()
+
+    def user_update(self, user_id: int, text: Optional[str] = None, data: Optional[str] = None) -> Dict[str, Any]:
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+        chat = {"id": user_id, "type": "private"}
+        if data is not None:
+            return {
+                "callback_query": {
+                    "id": str(next(self._message_ids)),
+                    "from": user,
+                    "chat_instance": "fake",
+                    "data": data,
+                    "message": {"message_id": 1, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "-"},
+                }
+            }
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": chat, "from": user, "text": text or ""}
+        if message["text"].startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(message["text"].split()[0])}]
+        return {"message": message}
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Confirmed updates are dropped, like the real API does
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout:
+            async with self._new_updates:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self._updates[:limit]
+
+    # ---------------- methods ----------------
+    def _message(self, params: Dict[str, Any], **extra) -> Dict[str, Any]:
+        chat_id = params.get("chat_id")
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if isinstance(chat_id, int) and chat_id > 0 else "group", "title": "fake"},
+            "from": BOT_USER,
+            **extra,
+        }
+        self.sent.append(msg)
+        return msg
+
+    def _photo(self) -> List[Dict[str, Any]]:
+        n = next(self._file_ids)
+        return [{"file_id": f"fake-photo-{n}", "file_unique_id": f"fp{n}", "width": 800, "height": 600}]
+
+    def _send_message(self, p):
+        return self._message(p, text=p.get("text", ""))
+
+    def _send_photo(self, p):
+        photo = p.get("photo")
+        # Reusing a file_id keeps it; an upload gets a fresh id
+        sizes = [{"file_id": photo, "file_unique_id": photo, "width": 800, "height": 600}] if isinstance(photo, str) and not photo.startswith("attach://") else self._photo()
+        return self._message(p, photo=sizes, **({"caption": p["caption"]} if p.get("caption") else {}))
+
+    def _send_document(self, p):
+        n = next(self._file_ids)
+        return self._message(p, document={"file_id": f"fake-doc-{n}", "file_unique_id": f"fd{n}"})
+
+    def _edit_message(self, p):
+        if p.get("inline_message_id"):
+            return True
+        return self._message(p, text=p.get("text", ""))
+
+    # ---------------- HTTP ----------------
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        params: Dict[str, Any] = {}
+        if request.method == "POST":
+            form = await request.post()
+            for key, value in form.items():
+                params[key] = "attach://upload" if hasattr(value, "file") else value
+        params.update(request.query)
+        return params
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        transport = request.transport
+        if transport is not None and id(transport) not in self._transports:
+            self._transports.add(id(transport))
+            self.connections += 1
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        self.calls[method] += 1
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000)
+        if method != "getupdates" and self.rate_429 and random.random() < self.rate_429:
+            self.errors_429 += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                },
+                status=429,
+            )
+        if method == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+        handler = self._methods.get(method)
+        if handler is None:
+            return web.json_response({"ok": False, "error_code": 404, "description": "Not Found: method not found"}, status=404)
+        return web.json_response({"ok": True, "result": handler(params)})
+
+    async def handle_config(self, request: web.Request) -> web.Response:
+        cfg = await request.json()
+        for key in ("latency_ms", "jitter_ms", "rate_429", "retry_after"):
+            if key in cfg:
+                setattr(self, key, type(getattr(self, key))(cfg[key]))
+        return web.json_response({"ok": True})
+
+    async def handle_push(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        for item in body if isinstance(body, list) else [body]:
+            if "user_id" in item:
+                item = self.user_update(int(item["user_id"]), text=item.get("text"), data=item.get("data"))
+            await self.push_update(item)
+        return web.json_response({"ok": True})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "calls": dict(self.calls),
+                "errors_429": self.errors_429,
+                "connections": self.connections,
+                "pending_updates": len(self._updates),
+                "last_sent": list(self.sent)[-20:],
+            }
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_post("/_control/config", self.handle_config)
+        app.router.add_post("/_control/updates", self.handle_push)
+        app.router.add_get("/_control/stats", self.handle_stats)
+        return app
+
+
+async def serve(api: FakeBotAPI, host: str, port: int, replay: Optional[str] = None) -> None:
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info("Fake Bot API on http://%s:%s (use BOT_API_BASE=http://%s:%s)", host, port, host, port)
+    if replay:
+        with open(replay, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    if "user_id" in item:
+                        item = api.user_update(int(item["user_id"]), text=item.get("text"), data=item.get("data"))
+                    await api.push_update(item)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="probability of answering 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--replay", help="JSONL of raw updates (or {user_id, text|data}) queued at start")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotAPI(args.latency_ms, args.jitter_ms, args.rate_429, args.retry_after)
+    try:
+        asyncio.run(serve(api, args.host, args.port, args.replay))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,140 @@
+# fanout.py
+# -*- coding: utf-8 -*-
+"""
+Concurrent, rate-limit-aware delivery of one message to many chats.
+
+Telegram limits (approximate, per bot):
+- ~30 messages per second overall
+- ~20 messages per minute into the same group/channel
+- ~1 message per second into the same private chat
+
+Every send takes a token from the global bucket and from the bucket of its chat;
+RetryAfter (429) and network/5xx errors are retried with backoff.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+GLOBAL_RATE = 30.0  # msg/s
+GROUP_RATE = 20 / 60.0  # msg/s into one group
+PRIVATE_RATE = 1.0  # msg/s into one private chat
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        # The lock keeps waiters in FIFO order while one of them sleeps for a token
+        async with self._lock:
+            while not self.try_acquire():
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def take(self, tokens: float = 1) -> None:
+        """Use tokens without waiting; the balance may go negative and later acquire() calls wait it off."""
+        self._refill()
+        self._tokens -= tokens
+
+    def penalize(self, seconds: float) -> None:
+        """Hold the next token back for `seconds` (used when Telegram answers 429)."""
+        self._refill()
+        self._tokens = min(self._tokens, 1.0 - seconds * self.rate)
+
+
+@dataclass
+class DeliveryResult:
+    chat_id: int
+    ok: bool
+    attempts: int
+    message_id: Optional[int] = None
+    error: Optional[str] = None
+    retryable: bool = True  # False when Telegram rejected the message itself
+
+
+class FanOutSender:
+    def __init__(
+        self,
+        bot: Bot,
+        max_parallel: int = 8,
+        max_attempts: int = 5,
+        base_backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        global_bucket: Optional[TokenBucket] = None,
+    ):
+        self.bot = bot
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.global_bucket = global_bucket or TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self._parallel = asyncio.Semaphore(max_parallel)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups/channels
+            bucket = TokenBucket(GROUP_RATE, 20) if chat_id < 0 else TokenBucket(PRIVATE_RATE, 1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1))
+        return delay * (0.5 + random.random() / 2)
+
+    async def send_one(self, chat_id: int, text: str, **kwargs) -> DeliveryResult:
+        chat_bucket = self._chat_bucket(chat_id)
+        attempt = 0
+        while True:
+            attempt += 1
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                async with self._parallel:
+                    sent = await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return DeliveryResult(chat_id, True, attempt, message_id=sent.message_id)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_attempts:
+                    return DeliveryResult(chat_id, False, attempt, error=str(e))
+                logging.warning("Flood limit for chat %s, retry in %ss", chat_id, e.retry_after)
+                # Next acquire() of this chat (ours and everyone else's) waits it out
+                chat_bucket.penalize(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_attempts:
+                    return DeliveryResult(chat_id, False, attempt, error=str(e))
+                delay = self._backoff(attempt)
+                logging.warning("Send to %s failed (%s), retry %s in %.1fs", chat_id, e, attempt, delay)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                # Forbidden, bad request, etc. — retrying won't help
+                return DeliveryResult(chat_id, False, attempt, error=str(e), retryable=False)
+
+    async def send(self, chat_ids: Iterable[int], text: str, **kwargs) -> List[DeliveryResult]:
+        """Send `text` to every chat concurrently; one result per chat, in input order."""
+        return list(await asyncio.gather(*(self.send_one(chat_id, text, **kwargs) for chat_id in chat_ids)))
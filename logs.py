@@ -0,0 +1,251 @@
+# logs.py
+# -*- coding: utf-8 -*-
+"""
+Structured logging that keeps its cost on the event loop constant.
+
+setup_logging() sends every record through a bounded queue to a QueueListener
+thread, which does the formatting (tracebacks included) and the writing. On the
+calling thread a log call is two filter checks and a put_nowait:
+
+- Context: LogContextMiddleware keeps user_id, FSM state and handler name in
+  contextvars while a handler runs; every record logged meanwhile carries them.
+- Repeats: the same warning/error template from the same line is let through
+  `burst` times per `window` seconds, the rest are dropped. Once the window is
+  over, a summary record with the template and "repeated": N is written (also at
+  exit), so a storm that stops still shows up. A Telegram outage that fails every
+  send logs a handful of tracebacks per minute instead of one per user.
+- Overflow: a full queue drops records instead of waiting; the next record that
+  fits carries "dropped": N.
+
+Both kinds of drops are counted in bot_log_records_dropped_total{reason}.
+Output is one JSON object per line, or plain text (LOG_FORMAT=text) for reading
+in a terminal.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+
+from metrics import log_records_dropped
+
+CONTEXT_FIELDS = ("user_id", "state", "handler")
+_context: Dict[str, ContextVar] = {field: ContextVar(f"log_{field}", default=None) for field in CONTEXT_FIELDS}
+
+
+class ContextFilter(logging.Filter):
+    """Copies the handler context onto the record; must run on the thread that logs."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for field, var in _context.items():
+            setattr(record, field, var.get())
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    def __init__(self, window: float = 60.0, burst: int = 5, max_keys: int = 1000):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.max_keys = max_keys
+        # (logger, level, file, line, template, exception type) -> [window start, count, suppressed]
+        self._seen: "OrderedDict[tuple, List[Any]]" = OrderedDict()
+        self._lock = threading.Lock()  # filter() runs on every logging thread, expired() on the reporter's
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True  # routine messages share templates ("Update id=%s is handled") by design
+        # The template, not the formatted text: "Send to %s failed" for 1000 chats is one key
+        key = (
+            record.name, record.levelno, record.pathname, record.lineno, str(record.msg),
+            record.exc_info[0] if record.exc_info else None,
+        )
+        now = time.monotonic()
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if entry is not None and entry[2]:
+                    record.repeated = entry[2]
+                self._seen[key] = [now, 1, 0]
+                self._seen.move_to_end(key)
+                if len(self._seen) > self.max_keys:
+                    self._seen.popitem(last=False)
+                return True
+            entry[1] += 1
+            if entry[1] <= self.burst:
+                return True
+            entry[2] += 1
+        log_records_dropped.inc("repeat")
+        return False
+
+    def expired(self, everything: bool = False) -> List[Tuple[tuple, int]]:
+        """(key, dropped count) of windows that are over (or all of them); the counts are reset."""
+        now = time.monotonic()
+        found = []
+        with self._lock:
+            for key, entry in self._seen.items():
+                if entry[2] and (everything or now - entry[0] >= self.window):
+                    found.append((key, entry[2]))
+                    entry[2] = 0
+        return found
+
+
+class _RepeatReporter(threading.Thread):
+    """Writes a summary record for every repeat window that ended with records dropped."""
+
+    def __init__(self, repeats: RepeatFilter, handler: "NonBlockingQueueHandler", interval: float):
+        super().__init__(name="log-repeats", daemon=True)
+        self.repeats = repeats
+        self.handler = handler
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.report()
+
+    def report(self, everything: bool = False) -> None:
+        for (name, level, pathname, lineno, template, exc_type), count in self.repeats.expired(everything):
+            record = logging.makeLogRecord({
+                "name": name, "levelno": level, "levelname": logging.getLevelName(level),
+                "pathname": pathname, "lineno": lineno, "msg": template, "args": None,
+                "repeated": count, **({"exc_type": exc_type.__name__} if exc_type else {}),
+            })
+            self.handler.enqueue(record)  # past the filters: this is the record that must not be dropped
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+        self.report(everything=True)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self._dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting, traceback rendering included, is left to the listener thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self._dropped:
+            record.dropped = self._dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+            log_records_dropped.inc("queue_full")
+        else:
+            self._dropped = 0
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)  # the queue may be full; wait for a slot at shutdown
+
+
+def _extras(record: logging.LogRecord) -> Dict[str, Any]:
+    fields = {}
+    for field in (*CONTEXT_FIELDS, "repeated", "exc_type", "dropped"):
+        value = getattr(record, field, None)
+        if value is not None:
+            fields[field] = value
+    return fields
+
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, static: Optional[Dict[str, Any]] = None):
+        super().__init__()
+        self.static = static or {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **self.static,
+            **_extras(record),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, static: Optional[Dict[str, Any]] = None):
+        prefix = "".join(f"[{k} {v}] " for k, v in (static or {}).items())
+        super().__init__(f"%(asctime)s {prefix}%(levelname)s:%(name)s:%(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        extras = _extras(record)
+        text = super().formatMessage(record)
+        return text + " " + " ".join(f"{k}={v}" for k, v in extras.items()) if extras else text
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = "json",
+    queue_size: int = 10_000,
+    repeat_window: float = 60.0,
+    repeat_burst: int = 5,
+    **static: Any,
+) -> QueueListener:
+    """Replace the root handlers with the queue pipeline; `static` fields go on every record."""
+    q: "queue.Queue" = queue.Queue(queue_size)
+    handler = NonBlockingQueueHandler(q)
+    repeats = RepeatFilter(repeat_window, repeat_burst)
+    handler.addFilter(ContextFilter())
+    handler.addFilter(repeats)
+
+    output = logging.StreamHandler()
+    output.setFormatter(TextFormatter(static) if fmt == "text" else JsonFormatter(static))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    listener = _Listener(q, output)
+    listener.start()
+    atexit.register(listener.stop)  # writes out whatever is still queued
+    reporter = _RepeatReporter(repeats, handler, interval=repeat_window / 2)
+    reporter.start()
+    atexit.register(reporter.stop)  # runs before listener.stop, so the last counts are written too
+    return listener
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Register as an inner middleware (like HandlerMetricsMiddleware) so the chosen handler is known."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        handler_obj = data.get("handler")
+        values = {
+            "user_id": user.id if user else None,
+            "state": data.get("raw_state"),
+            "handler": getattr(getattr(handler_obj, "callback", None), "__name__", None),
+        }
+        tokens = [(var, var.set(values[field])) for field, var in _context.items()]
+        try:
+            return await handler(event, data)
+        finally:
+            for var, token in tokens:
+                var.reset(token)
@@ -4,9 +4,11 @@
 7tech Telegram bot (RU/UZ) — aiogram v3.7+
 
 Features
-- Start → choose language (RU / UZ)
-- After language selection: brand photo + about text, show main menu (Products, Service, Contacts, About Us, Back)
+- Start → language of the user's Telegram app when the catalog has it, else choose language (RU / UZ);
+  /language or Back in the main menu changes it
+- Then: brand photo + about text, show main menu (Products, Service, Contacts, About Us, Back)
 - Products: large catalog list; when user selects a category, bot sends the specified URL
+- Inline search: `@bot конд` / `@bot kond` finds categories in either language (enable inline mode in @BotFather)
 - Service: warranty image + "I agree" → collect: appliance → region → problem → phone (typed) → exact address → send confirmation to user and forward the ticket to staff chat(s) of the region (supports multiple chat_ids per region)
 - Everywhere: Back button
 - Emoji in the end of friendly messages
@@ -17,195 +19,157 @@ Setup
    - brand_ru.jpg, brand_uz.jpg
    - warranty_ru.jpg, warranty_uz.jpg
 3) Set your bot token in BOT_TOKEN below (or via env var)
-4) Fill STAFF_BY_REGION chat_id lists with your Telegram chat IDs (can be groups or users). Multiple staff per region is supported.
+4) Edit catalog.json: staff_by_region chat_id lists (groups or users, several per region), products, texts.
+   Changes are picked up while the bot runs; an invalid file is rejected and the previous one kept.
+   More languages: add locales/<lang>.json (see catalog.py).
 5) python main.py
 """
 
+import sys
+import time
+
+_BOOT_T0 = time.perf_counter()  # cold-start timing includes the imports below
+
+if __name__ == "__mp_main__":
+    # A spawned worker (workers.py) runs this file under that name before it starts;
+    # its `import main` must get this module instead of executing the file again
+    sys.modules["main"] = sys.modules[__name__]
+
 import asyncio
+import html
 import logging
 import os
+import re
+from datetime import date
 from pathlib import Path
-from typing import Dict, List
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
 
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-from aiogram.filters import CommandStart
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import Command, CommandObject, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
 from aiogram.types import (
     CallbackQuery,
+    FSInputFile,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
     KeyboardButton,
     Message,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
+    User,
 )
-from aiogram.types import FSInputFile
+from aiohttp import FormData
+
+from boot import BootTimer, CachedMeBot, refresh_me, use_cached_me
+from bot_session import SessionProfile, TunedSession
+from broadcast import (
+    Broadcast,
+    BroadcastStore,
+    Broadcaster,
+    InteractiveTrafficMiddleware,
+    RegistryMiddleware,
+    SharedTraffic,
+)
+from catalog import BASE_LANG, Catalog, CatalogWatcher, compile_texts, load_catalog
+from executor import UserOrderedExecutor
+from fanout import FanOutSender
+from logs import LogContextMiddleware, setup_logging
+from media_cache import MediaCache
+from metrics import HandlerMetricsMiddleware, RequestMetricsMiddleware, start_metrics_server
+from outbox import Outbox, OutboxWorker
+from search import ProductIndex
+from storage import SQLiteStorage
+from throttle import ThrottleMiddleware
+from tickets import STATUSES, Ticket, TicketFilter, TicketStore, normalize_phone
+# Imported only where used, off the cold-start path: workers (multiprocessing) when
+# WORKERS > 1, webhook (aiohttp.web) in webhook mode, export (csv, gzip) for /export
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+boot_timer = BootTimer(_BOOT_T0)
+boot_timer.mark("imports")
 
 # ========================= CONFIG =========================
 BOT_TOKEN = os.getenv("BOT_TOKEN", "8494662446:AAFoV6ikXUXMRYYJFKu8TrDVi4JqKsqgyYs")
 IMAGES_DIR = Path(__file__).parent / "images"
-
-# Map of region -> list of staff chat IDs (edit these!)
-STAFF_BY_REGION: Dict[str, List[int]] = {
-    # RU labels (they are used internally; UZ shown by translation)
-    "Ташкент город": [888936051, 5579006763],
-    "Ташкент": [888936051],
-    "Андижан": [888936051],
-    "Наманган": [888936051],
-    "Фергана": [888936051],
-    "Сырдарья": [888936051],
-    "Джиззах": [888936051],
-    "Самарканд": [888936051],
-    "Бухара": [888936051],
-    "Кашкадарья": [888936051],
-    "Сурхандарья": [888936051],
-    "Наваи": [888936051],
-    "Хорезм": [888936051],
-}
-
-# Contacts (edit freely)
-CONTACTS_RU = (
-    "Телефон: +998 (71) 230-70-00 "
-    "Email: support@seventech.uz"
-)
-CONTACTS_UZ = (
-    "Telefon: +998 (71) 230-70-00 "
-    "Email: support@seventech.uz"
-)
-
-# Product categories and links (keys are internal canonical names)
-PRODUCT_LINKS = {
-    "Кондиционеры": "https://seventech.uz/market?category=kondicionery",
-    "Холодильники": "https://seventech.uz/market?category=xolodilniki",
-    "Телевизоры": "https://seventech.uz/market?category=televizory",
-    "Диспенсеры для воды": "https://seventech.uz/market?category=televizory",  # as requested
-    "Мониторы": "https://seventech.uz/market?category=monitory",
-    "Пылесосы": "https://seventech.uz/market?category=pylesosy",
-    "Стиральные машины": "https://seventech.uz/market?category=ctiralnye-masiny",
-    "Варочные панели": "https://seventech.uz/market?category=varocnye-paneli",
-    "Духовые шкафы": "https://seventech.uz/market?category=duxovye-skafy",
-    "Сушильные машины": "https://seventech.uz/market?category=susilnye-masiny",
-    "Вытяжки": "https://seventech.uz/market?category=vytiazki",
-    "Посудомоечные машины": "https://seventech.uz/market?category=posudomoecnye-masiny",
-    "Микроволновые печи": "https://seventech.uz/market?category=mikrovolnovye-peci",
-}
-
-# Appliances list reused in Service flow
-APPLIANCES = list(PRODUCT_LINKS.keys())
-
-# Regions list reused in Service flow (internal RU labels)
-REGIONS_RU = list(STAFF_BY_REGION.keys())
-
-# ========================= I18N =========================
-RU = {
-    "lang_name": "Русский",
-    "choose_language": "Выберите язык:",
-    "brand_caption": (
-        "7tech — бытовая техника нового уровня. Надёжность, качество и стиль для вашего дома. "
-        "Мы заботимся о каждом клиенте. 😊"
-    ),
-    "menu_products": "Продукции",
-    "menu_service": "Сервис",
-    "menu_contacts": "Контакты",
-    "menu_about": "О нас",
-    "menu_back": "⬅️ Назад",
-    "about_text": "Мы 7tech. Продаём самые лучшие и качественные бытовые техники ✨",
-    "contacts_text": CONTACTS_RU,
-    "products_title": "Выберите категорию продукции:",
-    "service_warranty_caption": "Гарантийные условия. Пожалуйста, ознакомьтесь и подтвердите.",
-    "agree": "Я соглашаюсь",
-    "ask_appliance": "С какой техникой вам нужен сервис?",
-    "ask_region": "Выберите ваш регион:",
-    "ask_problem": "Опишите вашу проблему:",
-    "ask_phone": "Укажите ваш номер телефона (введите текстом):",
-    "ask_address": "Уточните ваш точный адрес:",
-    "ticket_submitted": (
-        "Спасибо! Ваша заявка передана сотрудникам, она будет рассмотрена в течение 5 рабочих дней. "
-        "С вами свяжутся. 📩"
-    ),
-    "invalid_phone": "Похоже, номер некорректен. Введите, пожалуйста, снова (пример: +998901234567):",
-    "products_sent": "Откройте ссылку на выбранную категорию:",
-}
-
-UZ = {
-    "lang_name": "Oʻzbekcha",
-    "choose_language": "Tilni tanlang:",
-    "brand_caption": (
-        "7tech — zamonaviy maishiy texnika. Ishonchlilik, sifat va uslub sizning uyingiz uchun. "
-        "Har bir mijoz biz uchun muhim. 😊"
-    ),
-    "menu_products": "Mahsulotlar",
-    "menu_service": "Servis",
-    "menu_contacts": "Aloqa",
-    "menu_about": "Biz haqimizda",
-    "menu_back": "⬅️ Ortga",
-    "about_text": "Biz 7tech. Eng zoʻr va sifatli maishiy texnikalarni sotamiz ✨",
-    "contacts_text": CONTACTS_UZ,
-    "products_title": "Mahsulot turini tanlang:",
-    "service_warranty_caption": "Kafolat shartlari. Iltimos, tanishib chiqing va tasdiqlang.",
-    "agree": "Roziman",
-    "ask_appliance": "Qaysi texnika bo‘yicha servis kerak?",
-    "ask_region": "Hududingizni tanlang:",
-    "ask_problem": "Muammoni qisqacha yozing:",
-    "ask_phone": "Telefon raqamingizni kiriting (matn bilan):",
-    "ask_address": "Aniq manzilingizni yozing:",
-    "ticket_submitted": (
-        "Rahmat! So‘rovingiz xodimlarga yuborildi. 5 ish kuni ichida ko‘rib chiqiladi. "
-        "Siz bilan bog‘lanishadi. 📩"
-    ),
-    "invalid_phone": "Raqam noto‘g‘ri ko‘rinadi. Iltimos, qayta kiriting (namuna: +998901234567):",
-    "products_sent": "Tanlangan bo‘lim uchun havola:",
-}
-
-I18N = {"ru": RU, "uz": UZ}
-
-# Translations for product and region visible labels in UZ
-TRANSLATE_LABELS_UZ = {
-    # Products
-    "Продукции": "Mahsulotlar",
-    "Сервис": "Servis",
-    "Контакты": "Aloqa",
-    "О нас": "Biz haqimizda",
-    "⬅️ Назад": "⬅️ Ortga",
-    # Appliances
-    "Кондиционеры": "Konditsionerlar",
-    "Холодильники": "Muzlatkichlar",
-    "Телевизоры": "Televizorlar",
-    "Диспенсеры для воды": "Suv dispenserlari",
-    "Мониторы": "Monitorlar",
-    "Пылесосы": "Changyutgichlar",
-    "Стиральные машины": "Kir yuvish mashinalari",
-    "Варочные панели": "Pishirish panellari",
-    "Духовые шкафы": "Duxovkalar",
-    "Сушильные машины": "Quritish mashinalari",
-    "Вытяжки": "Moy tutgichlar",
-    "Посудомоечные машины": "Idish yuvish mashinalari",
-    "Микроволновые печи": "Mikroto‘lqinli pechlar",
-    # Regions
-    "Ташкент город": "Toshkent shahri",
-    "Ташкентская область": "Toshkent viloyati",
-    "Андижан": "Andijon",
-    "Наманган": "Namangan",
-    "Фергана": "Farg‘ona",
-    "Сырдарья": "Sirdaryo",
-    "Джиззах": "Jizzax",
-    "Самарканд": "Samarqand",
-    "Бухара": "Buxoro",
-    "Кашкадарья": "Qashqadaryo",
-    "Сурхандарья": "Surxondaryo",
-    "Наваи": "Navoiy",
-    "Хорезм": "Xorazm",
-}
-
-# Helper: display label for current language
-def label(lang: str, ru_label: str) -> str:
-    if lang == "uz":
-        return TRANSLATE_LABELS_UZ.get(ru_label, ru_label)
-    return ru_label
+DATA_DIR = Path(os.getenv("DATA_DIR", Path(__file__).parent / "data"))
+# Refuse to start when DATA_DIR is not on a mounted disk (see check_data_dir)
+REQUIRE_PERSISTENT_DATA = os.getenv("REQUIRE_PERSISTENT_DATA", "0") == "1"
+
+# Telegram file_ids of uploaded images survive restarts here
+MEDIA_CACHE_PATH = DATA_DIR / "media_cache.json"
+# The bot's own getMe answer, so a restart can take updates without asking again
+BOT_ME_PATH = DATA_DIR / "bot_me.json"
+# FSM sessions and language choices survive restarts here
+STORAGE_PATH = DATA_DIR / "storage.sqlite3"
+# Tickets wait here until every staff chat has received them
+OUTBOX_PATH = DATA_DIR / "outbox.sqlite3"
+# Every submitted ticket, searchable by staff with /tickets, moved along with /ticket_status
+TICKETS_PATH = DATA_DIR / "tickets.sqlite3"
+# Everyone who has used the bot, and announcements to them (staff: /broadcast)
+BROADCAST_PATH = DATA_DIR / "broadcast.sqlite3"
+# Broadcast messages/s; replies to users always go first and slow the broadcast down
+# (with WORKERS > 1 other processes' replies are charged ~1-2 s late, so leave headroom under 30)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+# Same phone + appliance within this many seconds is flagged as a repeat
+TICKET_DUPLICATE_WINDOW = float(os.getenv("TICKET_DUPLICATE_WINDOW", str(3 * 24 * 3600)))
+# "polling" (default) or "webhook"; webhook needs a public URL (Render sets RENDER_EXTERNAL_URL)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # empty: derived from the token, see webhook_secret()
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+# WORKERS > 1 starts a supervisor that shards users over that many processes
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))  # set by the supervisor in each worker
+# Prometheus text on http://METRICS_HOST:METRICS_PORT/metrics (+ worker index); 0 disables
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Optional chat (e.g. a staff group) used to pre-upload images at startup
+MEDIA_WARMUP_CHAT_ID = int(os.getenv("MEDIA_WARMUP_CHAT_ID", "0")) or None
+# "edit" (default): navigation edits messages in place and attaches keyboards to the
+# content itself; "send": every step sends new messages (previous behavior)
+NAV_EDIT = os.getenv("NAV_MODE", "edit").lower() == "edit"
+# Tickets to the same staff chat within DIGEST_WINDOW seconds go out as one digest
+# (0 = one message per ticket); DIGEST_MAX_TICKETS held tickets flush at once
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "0"))
+DIGEST_MAX_TICKETS = int(os.getenv("DIGEST_MAX_TICKETS", "10"))
+# Per-user flood limit: THROTTLE_RATE updates/s (0 disables) with bursts of THROTTLE_BURST;
+# the same text/callback repeated within DEDUP_WINDOW seconds is dropped
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "5"))
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", "2"))
+# Updates of one user run in order, different users in parallel (UPDATE_CONCURRENCY
+# handlers at a time; 0 runs every update inline); the queue limits shed excess load
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+UPDATE_QUEUE_LIMIT = int(os.getenv("UPDATE_QUEUE_LIMIT", "10000"))
+UPDATE_USER_QUEUE_LIMIT = int(os.getenv("UPDATE_USER_QUEUE_LIMIT", "20"))
+# How long Telegram may reuse an inline search answer for the same user and query
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+
+# Logs: JSON lines on stderr ("text" for reading in a terminal), written by a background
+# thread; the same error from the same place is logged LOG_REPEAT_BURST times per
+# LOG_REPEAT_WINDOW seconds, anything beyond LOG_QUEUE_SIZE queued records is dropped
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_REPEAT_WINDOW = float(os.getenv("LOG_REPEAT_WINDOW", "60"))
+LOG_REPEAT_BURST = int(os.getenv("LOG_REPEAT_BURST", "5"))
+
+# Texts, products, regions and staff chats; edits are picked up without a restart
+CATALOG_PATH = Path(os.getenv("CATALOG_PATH", Path(__file__).parent / "catalog.json"))
+CATALOG_RELOAD_INTERVAL = float(os.getenv("CATALOG_RELOAD_INTERVAL", "5"))  # seconds; 0 disables
 
 # ========================= STATES =========================
 class ServiceForm(StatesGroup):
@@ -217,27 +181,89 @@ class ServiceForm(StatesGroup):
     waiting_address = State()
     submitted = State()
 
+
+# Form steps with a reply keyboard of their own, where Back goes one step back
+SERVICE_STEPS = frozenset(
+    s.state
+    for s in (
+        ServiceForm.waiting_appliance,
+        ServiceForm.waiting_region,
+        ServiceForm.waiting_problem,
+        ServiceForm.waiting_phone,
+        ServiceForm.waiting_address,
+    )
+)
+
 # ========================= UTIL =========================
-user_lang: Dict[int, str] = {}  # user_id -> 'ru'|'uz'
+storage = SQLiteStorage(STORAGE_PATH)
+user_lang = storage.langs  # user_id -> 'ru'|'uz'
+media_cache = MediaCache(MEDIA_CACHE_PATH)
+outbox = Outbox(OUTBOX_PATH, digest_size=DIGEST_MAX_TICKETS)
+tickets = TicketStore(TICKETS_PATH, duplicate_window=TICKET_DUPLICATE_WINDOW)
+broadcasts = BroadcastStore(BROADCAST_PATH)
+broadcaster = Broadcaster(broadcasts, rate=BROADCAST_RATE)  # runs in the lead process only
+traffic = SharedTraffic(broadcasts, WORKER_INDEX)  # tallied across processes in worker mode only
+executor = (
+    UserOrderedExecutor(UPDATE_CONCURRENCY, UPDATE_QUEUE_LIMIT, UPDATE_USER_QUEUE_LIMIT) if UPDATE_CONCURRENCY > 0 else None
+)
+_fanout: Dict[int, FanOutSender] = {}  # id(bot) -> sender
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def get_fanout(bot: Bot) -> FanOutSender:
+    sender = _fanout.get(id(bot))
+    if sender is None:
+        sender = _fanout[id(bot)] = FanOutSender(bot)
+    return sender
+
+
+def spawn(coro) -> asyncio.Task:
+    """Run `coro` in the background, keeping a reference until it finishes."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def edit_or_answer(message: Message, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+    """Replace a bot message's text in place; send a new one where Telegram refuses the edit."""
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" in e.message:
+            return
+        # Too old, a photo, deleted meanwhile, ...
+        await message.answer(text, reply_markup=reply_markup)
 
 
-def t(user_id: int, key: str) -> str:
-    lang = user_lang.get(user_id, "ru")
-    return I18N[lang][key]
+def preferred_language(snap: "Snapshot", user: User) -> Optional[str]:
+    """The language the user picked, else the one of their Telegram app; None if unsupported."""
+    lang = user_lang.get(user.id)
+    # A language can disappear from the catalog on reload
+    if lang in snap.texts:
+        return lang
+    return snap.catalog.language_for(user.language_code)
 
 
-def main_menu_kb(lang: str) -> ReplyKeyboardMarkup:
+def user_language(snap: "Snapshot", user: User) -> str:
+    return preferred_language(snap, user) or BASE_LANG
+
+
+# ========================= KEYBOARDS =========================
+# Builders run once per catalog version; handlers get shared, frozen markups.
+def _build_main_menu_kb(cat: Catalog, lang: str) -> ReplyKeyboardMarkup:
+    texts = cat.i18n[lang]
     return ReplyKeyboardMarkup(
         keyboard=[
             [
-                KeyboardButton(text=I18N[lang]["menu_products"]),
-                KeyboardButton(text=I18N[lang]["menu_service"]),
+                KeyboardButton(text=texts["menu_products"]),
+                KeyboardButton(text=texts["menu_service"]),
             ],
             [
-                KeyboardButton(text=I18N[lang]["menu_contacts"]),
-                KeyboardButton(text=I18N[lang]["menu_about"]),
+                KeyboardButton(text=texts["menu_contacts"]),
+                KeyboardButton(text=texts["menu_about"]),
             ],
-            [KeyboardButton(text=I18N[lang]["menu_back"])],
+            [KeyboardButton(text=texts["menu_back"])],
         ],
         resize_keyboard=True,
         input_field_placeholder=None,
@@ -245,145 +271,342 @@ def main_menu_kb(lang: str) -> ReplyKeyboardMarkup:
     )
 
 
-def language_kb() -> ReplyKeyboardMarkup:
+def _build_language_kb(cat: Catalog) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="Русский"), KeyboardButton(text="Oʻzbekcha")]],
+        keyboard=[[KeyboardButton(text=cat.i18n[lang]["lang_name"]) for lang in cat.languages]],
         resize_keyboard=True,
         is_persistent=True,
     )
 
 
-def appliances_kb(lang: str) -> ReplyKeyboardMarkup:
-    rows = []
-    row: List[KeyboardButton] = []
-    for idx, item in enumerate(APPLIANCES, start=1):
-        row.append(KeyboardButton(text=label(lang, item)))
-        if idx % 2 == 0:
-            rows.append(row)
-            row = []
-    if row:
-        rows.append(row)
-    rows.append([KeyboardButton(text=I18N[lang]["menu_back"])])
-    return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True)
-
-
-def regions_kb(lang: str) -> ReplyKeyboardMarkup:
+def _build_grid_kb(cat: Catalog, lang: str, items: Tuple[str, ...]) -> ReplyKeyboardMarkup:
     rows = []
     row: List[KeyboardButton] = []
-    for idx, reg in enumerate(REGIONS_RU, start=1):
-        row.append(KeyboardButton(text=label(lang, reg)))
+    for idx, item in enumerate(items, start=1):
+        row.append(KeyboardButton(text=cat.label(lang, item)))
         if idx % 2 == 0:
             rows.append(row)
             row = []
     if row:
         rows.append(row)
-    rows.append([KeyboardButton(text=I18N[lang]["menu_back"])])
+    rows.append([KeyboardButton(text=cat.i18n[lang]["menu_back"])])
     return ReplyKeyboardMarkup(keyboard=rows, resize_keyboard=True)
 
 
-def products_inline_kb(lang: str) -> InlineKeyboardMarkup:
+def _build_products_inline_kb(cat: Catalog, lang: str) -> InlineKeyboardMarkup:
     buttons = []
     row = []
-    for idx, name in enumerate(APPLIANCES, start=1):
-        row.append(InlineKeyboardButton(text=label(lang, name), callback_data=f"prod:{name}"))
+    for idx, name in enumerate(cat.appliances, start=1):
+        row.append(InlineKeyboardButton(text=cat.label(lang, name), callback_data=f"prod:{name}"))
         if idx % 2 == 0:
             buttons.append(row)
             row = []
     if row:
         buttons.append(row)
     # Inline back to just delete message (user can use ReplyKeyboard Back too)
-    buttons.append([InlineKeyboardButton(text=I18N[lang]["menu_back"], callback_data="prod_back")])
+    buttons.append([InlineKeyboardButton(text=cat.i18n[lang]["menu_back"], callback_data="prod_back")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def warranty_inline_kb(user_id: int) -> InlineKeyboardMarkup:
+def _build_back_kb(cat: Catalog, lang: str) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=cat.i18n[lang]["menu_back"])]], resize_keyboard=True)
+
+
+def _build_warranty_inline_kb(cat: Catalog, lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text=t(user_id, "agree"), callback_data="agree")]]
+        inline_keyboard=[[InlineKeyboardButton(text=cat.i18n[lang]["agree"], callback_data="agree")]]
     )
 
 
+Markup = Union[ReplyKeyboardMarkup, InlineKeyboardMarkup]
+
+
+class KeyboardRegistry:
+    """All markups of one catalog version, built once per language and shared.
+
+    Markups are frozen pydantic models, so sharing is safe; their JSON form is
+    memoized the first time they are sent (see PreparedMarkupSession) and reused
+    for every later request body.
+    """
+
+    def __init__(self, cat: Catalog):
+        markups: Dict[Tuple[str, str], Markup] = {("*", "language"): _build_language_kb(cat)}
+        for lang in cat.languages:
+            markups[(lang, "main_menu")] = _build_main_menu_kb(cat, lang)
+            markups[(lang, "appliances")] = _build_grid_kb(cat, lang, cat.appliances)
+            markups[(lang, "regions")] = _build_grid_kb(cat, lang, cat.regions)
+            markups[(lang, "products")] = _build_products_inline_kb(cat, lang)
+            markups[(lang, "back")] = _build_back_kb(cat, lang)
+            markups[(lang, "warranty")] = _build_warranty_inline_kb(cat, lang)
+        self._markups = markups
+        self._shared: Dict[int, Markup] = {id(m): m for m in markups.values()}
+        self._json: Dict[int, str] = {}  # id(markup) -> serialized reply_markup
+
+    def main_menu(self, lang: str) -> ReplyKeyboardMarkup:
+        return self._markups[(lang, "main_menu")]
+
+    def language(self) -> ReplyKeyboardMarkup:
+        return self._markups[("*", "language")]
+
+    def appliances(self, lang: str) -> ReplyKeyboardMarkup:
+        return self._markups[(lang, "appliances")]
+
+    def regions(self, lang: str) -> ReplyKeyboardMarkup:
+        return self._markups[(lang, "regions")]
+
+    def products(self, lang: str) -> InlineKeyboardMarkup:
+        return self._markups[(lang, "products")]
+
+    def back(self, lang: str) -> ReplyKeyboardMarkup:
+        return self._markups[(lang, "back")]
+
+    def warranty(self, lang: str) -> InlineKeyboardMarkup:
+        return self._markups[(lang, "warranty")]
+
+    def is_shared(self, markup: object) -> bool:
+        return self._shared.get(id(markup)) is markup
+
+    def serialized(self, markup: Markup, dump: Callable[[], str]) -> str:
+        key = id(markup)
+        cached = self._json.get(key)
+        if cached is None:
+            cached = self._json[key] = dump()
+        return cached
+
+
+# ========================= ROUTING INDEX =========================
+class Route(NamedTuple):
+    action: str  # "language" | "menu_*" | "appliance" | "region"
+    key: Optional[str]  # canonical RU name for appliance/region, else None
+    lang: str
+
+
+MENU_ACTIONS = ("menu_products", "menu_service", "menu_contacts", "menu_about", "menu_back")
+
+
+def build_routes(cat: Catalog) -> Dict[str, Route]:
+    """Map every button text of every language to what it means.
+
+    Earlier entries win on collisions (menu before catalog, RU before UZ), so a label
+    without a translation still resolves to its RU meaning.
+    """
+    routes: Dict[str, Route] = {}
+    for lang in cat.languages:
+        routes.setdefault(cat.i18n[lang]["lang_name"], Route("language", None, lang))
+        for action in MENU_ACTIONS:
+            routes.setdefault(cat.i18n[lang][action], Route(action, None, lang))
+    for action, items in (("appliance", cat.appliances), ("region", cat.regions)):
+        for lang in cat.languages:
+            for ru_name in items:
+                routes.setdefault(cat.label(lang, ru_name), Route(action, ru_name, lang))
+    return routes
+
+
+def _build_product_article(cat: Catalog, lang: str, idx: int, name: str) -> InlineQueryResultArticle:
+    title = cat.label(lang, name)
+    link = cat.product_links[name]
+    return InlineQueryResultArticle(
+        id=f"prod{idx}",
+        title=title,
+        description=link,
+        url=link,
+        input_message_content=InputTextMessageContent(message_text=f"{title}: {link}"),
+    )
+
+
+# ========================= CATALOG SNAPSHOT =========================
+class Snapshot:
+    """One catalog version together with the routes and keyboards compiled from it.
+
+    Handlers take `snap = current()` once and use only that object, so a reload
+    (which swaps the whole snapshot) never shows them a mix of old and new data.
+    """
+
+    __slots__ = ("catalog", "i18n", "texts", "language_prompt", "routes", "keyboards", "search", "staff_chats", "_articles")
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        self.i18n = catalog.i18n
+        self.texts = compile_texts(catalog)  # lang -> bundle; snap.texts[lang].ask_phone
+        # "Выберите язык / Tilni tanlang:" for users whose language is not known yet
+        self.language_prompt = " / ".join(t.choose_language.rstrip(": ") for t in self.texts.values()) + ":"
+        self.routes = build_routes(catalog)
+        self.keyboards = KeyboardRegistry(catalog)
+        self.search = ProductIndex.from_catalog(catalog)
+        self.staff_chats = frozenset(chat_id for ids in catalog.staff_by_region.values() for chat_id in ids)
+        self._articles = {
+            (lang, name): _build_product_article(catalog, lang, idx, name)
+            for lang in catalog.languages
+            for idx, name in enumerate(catalog.appliances)
+        }
+
+    def label(self, lang: str, ru_label: str) -> str:
+        return self.catalog.label(lang, ru_label)
+
+    def inline_results(self, lang: str, query: str) -> List[InlineQueryResultArticle]:
+        return [self._articles[(lang, name)] for name in self.search.search(query)]
+
+
+_snapshot = Snapshot(load_catalog(CATALOG_PATH))
+
+
+def current() -> Snapshot:
+    return _snapshot
+
+
+async def apply_catalog(catalog: Catalog) -> None:
+    """Compile a reloaded catalog off the event loop, then swap it in at once."""
+    global _snapshot
+    _snapshot = await asyncio.to_thread(Snapshot, catalog)
+
+
+class PreparedMarkupSession(TunedSession):
+    """Bot API session that serializes each shared keyboard only once."""
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        # build_form_data dumps the whole method to dicts before prepare_value sees it,
+        # so the shared markup has to be taken out here, while it is still the object
+        markup = getattr(method, "reply_markup", None)
+        keyboards = current().keyboards
+        if markup is None or not keyboards.is_shared(markup):
+            return super().build_form_data(bot, method)
+        form = super().build_form_data(bot, method.model_copy(update={"reply_markup": None}))
+        form.add_field(
+            "reply_markup",
+            keyboards.serialized(markup, lambda: self.prepare_value(markup.model_dump(warnings=False), bot, {})),
+        )
+        return form
+
+
+def is_language_button(message: Message) -> bool:
+    route = current().routes.get(message.text or "")
+    return route is not None and route.action == "language"
+
+
 # ========================= ROUTER =========================
 router = Router()
 
 
+def localized_image(kind: str, lang: str) -> Path:
+    """images/<kind>_<lang>.jpg, or the base language's picture for languages without one."""
+    path = IMAGES_DIR / f"{kind}_{lang}.jpg"
+    return path if path.exists() else IMAGES_DIR / f"{kind}_{BASE_LANG}.jpg"
+
+
 @router.message(CommandStart())
 async def cmd_start(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("Выберите язык / Tilni tanlang:", reply_markup=language_kb())
+    snap = current()
+    # Most users' Telegram app already tells the language; the picker is for the rest
+    lang = preferred_language(snap, message.from_user)
+    if lang is None:
+        await message.answer(snap.language_prompt, reply_markup=snap.keyboards.language())
+    else:
+        await show_home(message, snap, lang)
+
+
+@router.message(Command("language"))
+async def cmd_language(message: Message, state: FSMContext):
+    await state.clear()
+    snap = current()
+    await message.answer(snap.language_prompt, reply_markup=snap.keyboards.language())
 
 
-@router.message(F.text.in_({"Русский", "Oʻzbekcha"}))
+@router.message(is_language_button)
 async def set_language(message: Message, state: FSMContext):
-    lang = "ru" if message.text == "Русский" else "uz"
+    snap = current()
+    lang = snap.routes[message.text].lang
+    # An explicit choice overrides the language of the Telegram app
     user_lang[message.from_user.id] = lang
+    await show_home(message, snap, lang)
 
-    # Send brand image + text
-    img_name = "brand_ru.jpg" if lang == "ru" else "brand_uz.jpg"
-    img_path = IMAGES_DIR / img_name
-    caption = I18N[lang]["brand_caption"]
+
+async def show_home(message: Message, snap: Snapshot, lang: str):
+    # Send brand image + text; in edit mode it carries the main menu itself
+    img_path = localized_image("brand", lang)
+    caption = snap.texts[lang].brand_caption
+    menu = snap.keyboards.main_menu(lang) if NAV_EDIT else None
 
     if img_path.exists():
         try:
-            await message.answer_photo(photo=FSInputFile(str(img_path)), caption=caption)
+            await media_cache.answer_photo(message, img_path, caption=caption, reply_markup=menu)
         except Exception as e:
             logging.exception("Failed to send brand image: %s", e)
-            await message.answer(caption)
+            await message.answer(caption, reply_markup=menu)
     else:
-        await message.answer(caption)
+        await message.answer(caption, reply_markup=menu)
 
-    # Show main menu
-    await message.answer("⁣", reply_markup=main_menu_kb(lang))  # invisible char to push keyboard
+    if not NAV_EDIT:
+        # Show main menu
+        await message.answer("⁣", reply_markup=snap.keyboards.main_menu(lang))  # invisible char to push keyboard
 
 
 @router.message(F.text)
 async def main_handler(message: Message, state: FSMContext):
     uid = message.from_user.id
-    lang = user_lang.get(uid, "ru")
+    snap = current()
+    lang = user_language(snap, message.from_user)
     text = message.text
 
+    route = snap.routes.get(text)
+    action = route.action if route else None
+    if action in MENU_ACTIONS and route.lang != lang:
+        # The button text tells which keyboard the user is looking at
+        lang = user_lang[uid] = route.lang
+
     # Map Back
-    if text == I18N[lang]["menu_back"]:
+    if action == "menu_back":
+        if await state.get_state() in SERVICE_STEPS:
+            # One step back within the form
+            await service_flow_handler(message, state, snap)
+            return
+        # From the main menu, Back is where the language is changed
         await state.clear()
-        await message.answer(t(uid, "choose_language"), reply_markup=language_kb())
+        await message.answer(snap.texts[lang].choose_language, reply_markup=snap.keyboards.language())
         return
 
     # Main menu entries
-    if text in (I18N[lang]["menu_products"],):
+    if action == "menu_products":
         # Show inline keyboard with a non-empty text to satisfy Telegram API
-        await message.answer(t(uid, "products_title"), reply_markup=products_inline_kb(lang))
+        await message.answer(snap.texts[lang].products_title, reply_markup=snap.keyboards.products(lang))
         return
 
-    if text in (I18N[lang]["menu_contacts"],):
-        await message.answer(t(uid, "contacts_text"), reply_markup=main_menu_kb(lang))
+    if action == "menu_contacts":
+        await message.answer(snap.texts[lang].contacts_text, reply_markup=snap.keyboards.main_menu(lang))
         return
 
-    if text in (I18N[lang]["menu_about"],):
-        await message.answer(t(uid, "about_text"), reply_markup=main_menu_kb(lang))
+    if action == "menu_about":
+        await message.answer(snap.texts[lang].about_text, reply_markup=snap.keyboards.main_menu(lang))
         return
 
-    if text in (I18N[lang]["menu_service"],):
-        await start_service_flow(message, state)
+    if action == "menu_service":
+        await start_service_flow(message, state, snap)
         return
 
     # During service flow, delegate to states
     current_state = await state.get_state()
     if current_state and current_state.startswith(ServiceForm.__name__):
-        await service_flow_handler(message, state)
+        await service_flow_handler(message, state, snap)
         return
 
     # Unknown input → remind menu
-    await message.answer(t(uid, "choose_language"), reply_markup=language_kb())
+    await message.answer(snap.texts[lang].main_menu_title, reply_markup=snap.keyboards.main_menu(lang))
 
 
 @router.callback_query(F.data.startswith("prod:"))
 async def product_click(callback: CallbackQuery):
-    uid = callback.from_user.id
-    lang = user_lang.get(uid, "ru")
+    snap = current()
+    lang = user_language(snap, callback.from_user)
     name_ru = callback.data.split(":", 1)[1]
-    link = PRODUCT_LINKS.get(name_ru)
+    link = snap.catalog.product_links.get(name_ru)
     if link:
         await callback.answer()
-        await callback.message.answer(f"{t(uid, 'products_sent')} {link}", reply_markup=main_menu_kb(lang))
+        text = f"{snap.texts[lang].products_sent} {link}"
+        if NAV_EDIT:
+            # The list stays under the link, so the next category is one tap away
+            await edit_or_answer(callback.message, text, snap.keyboards.products(lang))
+        else:
+            await callback.message.answer(text, reply_markup=snap.keyboards.main_menu(lang))
     else:
         await callback.answer("Not found", show_alert=True)
 
@@ -391,30 +614,38 @@ async def product_click(callback: CallbackQuery):
 @router.callback_query(F.data == "prod_back")
 async def product_back(callback: CallbackQuery):
     await callback.answer()
-    uid = callback.from_user.id
-    lang = user_lang.get(uid, "ru")
+    snap = current()
+    lang = user_language(snap, callback.from_user)
     await callback.message.delete()
-    await callback.message.answer("⁣", reply_markup=main_menu_kb(lang))
+    if not NAV_EDIT:
+        await callback.message.answer("⁣", reply_markup=snap.keyboards.main_menu(lang))
+    # In edit mode the persistent main menu keyboard is still there underneath
+
+
+@router.inline_query()
+async def inline_search(query: InlineQuery):
+    snap = current()
+    lang = user_language(snap, query.from_user)
+    # Titles follow the user's language, so Telegram must not share answers between users
+    await query.answer(snap.inline_results(lang, query.query), cache_time=INLINE_CACHE_TIME, is_personal=True)
 
 
 # ========================= SERVICE FLOW =========================
-async def start_service_flow(message: Message, state: FSMContext):
-    uid = message.from_user.id
-    lang = user_lang.get(uid, "ru")
+async def start_service_flow(message: Message, state: FSMContext, snap: Snapshot):
+    lang = user_language(snap, message.from_user)
 
     # Send warranty image + agree button
-    img_name = "warranty_ru.jpg" if lang == "ru" else "warranty_uz.jpg"
-    img_path = IMAGES_DIR / img_name
-    caption = t(uid, "service_warranty_caption")
+    img_path = localized_image("warranty", lang)
+    caption = snap.texts[lang].service_warranty_caption
 
     if img_path.exists():
         try:
-            await message.answer_photo(photo=FSInputFile(str(img_path)), caption=caption, reply_markup=warranty_inline_kb(uid))
+            await media_cache.answer_photo(message, img_path, caption=caption, reply_markup=snap.keyboards.warranty(lang))
         except Exception as e:
             logging.exception("Failed to send warranty: %s", e)
-            await message.answer(caption, reply_markup=warranty_inline_kb(uid))
+            await message.answer(caption, reply_markup=snap.keyboards.warranty(lang))
     else:
-        await message.answer(caption, reply_markup=warranty_inline_kb(uid))
+        await message.answer(caption, reply_markup=snap.keyboards.warranty(lang))
 
     await state.set_state(ServiceForm.waiting_agree)
 
@@ -422,95 +653,89 @@ async def start_service_flow(message: Message, state: FSMContext):
 @router.callback_query(F.data == "agree")
 async def agreed(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
-    uid = callback.from_user.id
-    lang = user_lang.get(uid, "ru")
+    snap = current()
+    lang = user_language(snap, callback.from_user)
 
-    await callback.message.answer(t(uid, "ask_appliance"), reply_markup=appliances_kb(lang))
+    await callback.message.answer(snap.texts[lang].ask_appliance, reply_markup=snap.keyboards.appliances(lang))
     await state.set_state(ServiceForm.waiting_appliance)
 
 
-async def service_flow_handler(message: Message, state: FSMContext):
-    uid = message.from_user.id
-    lang = user_lang.get(uid, "ru")
+async def service_flow_handler(message: Message, state: FSMContext, snap: Snapshot):
+    lang = user_language(snap, message.from_user)
     data = await state.get_data()
     current = await state.get_state()
 
-    back = I18N[lang]["menu_back"]
+    back = snap.texts[lang].menu_back
 
     # waiting_appliance
     if current == ServiceForm.waiting_appliance.state:
         if message.text == back:
             await state.clear()
-            await message.answer("⁣", reply_markup=main_menu_kb(lang))
+            # A reply keyboard can only be switched by a new message; say what it is
+            await message.answer(snap.texts[lang].main_menu_title if NAV_EDIT else "⁣", reply_markup=snap.keyboards.main_menu(lang))
             return
         # Normalize to RU internal name
-        choice_ru = None
-        for ru_name in APPLIANCES:
-            if message.text in {ru_name, label(lang, ru_name)}:
-                choice_ru = ru_name
-                break
+        route = snap.routes.get(message.text)
+        choice_ru = route.key if route and route.action == "appliance" else None
         if not choice_ru:
-            await message.answer(t(uid, "ask_appliance"))
+            await message.answer(snap.texts[lang].ask_appliance)
             return
         await state.update_data(appliance=choice_ru)
-        await message.answer(t(uid, "ask_region"), reply_markup=regions_kb(lang))
+        await message.answer(snap.texts[lang].ask_region, reply_markup=snap.keyboards.regions(lang))
         await state.set_state(ServiceForm.waiting_region)
         return
 
     # waiting_region
     if current == ServiceForm.waiting_region.state:
         if message.text == back:
-            await message.answer(t(uid, "ask_appliance"), reply_markup=appliances_kb(lang))
+            await message.answer(snap.texts[lang].ask_appliance, reply_markup=snap.keyboards.appliances(lang))
             await state.set_state(ServiceForm.waiting_appliance)
             return
         # Normalize to RU internal region label
-        region_ru = None
-        for ru_reg in REGIONS_RU:
-            if message.text in {ru_reg, label(lang, ru_reg)}:
-                region_ru = ru_reg
-                break
+        route = snap.routes.get(message.text)
+        region_ru = route.key if route and route.action == "region" else None
         if not region_ru:
-            await message.answer(t(uid, "ask_region"))
+            await message.answer(snap.texts[lang].ask_region)
             return
         await state.update_data(region=region_ru)
-        await message.answer(t(uid, "ask_problem"), reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=back)]], resize_keyboard=True))
+        await message.answer(snap.texts[lang].ask_problem, reply_markup=snap.keyboards.back(lang))
         await state.set_state(ServiceForm.waiting_problem)
         return
 
     # waiting_problem
     if current == ServiceForm.waiting_problem.state:
         if message.text == back:
-            await message.answer(t(uid, "ask_region"), reply_markup=regions_kb(lang))
+            await message.answer(snap.texts[lang].ask_region, reply_markup=snap.keyboards.regions(lang))
             await state.set_state(ServiceForm.waiting_region)
             return
         await state.update_data(problem=message.text)
-        await message.answer(t(uid, "ask_phone"), reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=back)]], resize_keyboard=True))
+        await message.answer(snap.texts[lang].ask_phone, reply_markup=snap.keyboards.back(lang))
         await state.set_state(ServiceForm.waiting_phone)
         return
 
     # waiting_phone
     if current == ServiceForm.waiting_phone.state:
         if message.text == back:
-            await message.answer(t(uid, "ask_problem"), reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=back)]], resize_keyboard=True))
+            await message.answer(snap.texts[lang].ask_problem, reply_markup=snap.keyboards.back(lang))
             await state.set_state(ServiceForm.waiting_problem)
             return
         phone = message.text.strip()
         if not is_valid_phone(phone):
-            await message.answer(t(uid, "invalid_phone"))
+            await message.answer(snap.texts[lang].invalid_phone)
             return
         await state.update_data(phone=phone)
-        await message.answer(t(uid, "ask_address"), reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=back)]], resize_keyboard=True))
+        await message.answer(snap.texts[lang].ask_address, reply_markup=snap.keyboards.back(lang))
         await state.set_state(ServiceForm.waiting_address)
         return
 
     # waiting_address
     if current == ServiceForm.waiting_address.state:
         if message.text == back:
-            await message.answer(t(uid, "ask_phone"), reply_markup=ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=back)]], resize_keyboard=True))
+            await message.answer(snap.texts[lang].ask_phone, reply_markup=snap.keyboards.back(lang))
             await state.set_state(ServiceForm.waiting_phone)
             return
         await state.update_data(address=message.text)
-        await submit_ticket(message, state)
+        await submit_ticket(message, state, snap)
         return
 
 
@@ -520,14 +745,13 @@ def is_valid_phone(s: str) -> bool:
     return len(digits) >= 9
 
 
-async def submit_ticket(message: Message, state: FSMContext):
-    uid = message.from_user.id
-    lang = user_lang.get(uid, "ru")
+async def submit_ticket(message: Message, state: FSMContext, snap: Snapshot):
+    lang = user_language(snap, message.from_user)
     data = await state.get_data()
 
     # Guard against double submit
     if data.get("_submitted"):
-        await message.answer(t(uid, "ticket_submitted"), reply_markup=main_menu_kb(lang))
+        await message.answer(snap.texts[lang].ticket_submitted, reply_markup=snap.keyboards.main_menu(lang))
         return
 
     appliance_ru = data.get("appliance", "-")
@@ -538,46 +762,465 @@ async def submit_ticket(message: Message, state: FSMContext):
 
     user = message.from_user
     username = f"@{user.username}" if user.username else "—"
-
+    # Staff messages go out as HTML (the bot's default parse mode); user input is text
+    e = html.escape
+
+    urgent = snap.catalog.is_urgent(problem)
+    # The key is stable across redelivery of the same update, so it can't double-post.
+    idem_key = f"ticket:{message.chat.id}:{message.message_id}"
+    ticket_id, duplicate_of = await tickets.add(
+        idem_key,
+        user_id=user.id,
+        username=user.username,
+        full_name=user.full_name,
+        lang=lang,
+        appliance=appliance_ru,
+        region=region_ru,
+        problem=problem,
+        phone=phone,
+        address=address,
+        urgent=urgent,
+    )
     ticket_text = (
-        "📨 Новая заявка на сервис"
-        f"👤 Пользователь: {user.full_name} ({username}, id={user.id})"
-        f"📦 Техника: {appliance_ru}"
-        f"📍 Регион: {region_ru}"
-        f"📝 Проблема: {problem}"
-        f"📞 Телефон: {phone}"
-        f"🏠 Адрес: {address}"
+        ("🚨 СРОЧНО " if urgent else "")
+        + f"📨 Новая заявка на сервис #{ticket_id}"
+        + (f" ♻️ повтор заявки #{duplicate_of}" if duplicate_of else "")
+        + f"👤 Пользователь: {e(user.full_name)} ({e(username)}, id={user.id})"
+        f"📦 Техника: {e(appliance_ru)}"
+        f"📍 Регион: {e(region_ru)}"
+        f"📝 Проблема: {e(problem)}"
+        f"📞 Телефон: {e(phone)}"
+        f"🏠 Адрес: {e(address)}"
     )
 
-    # Forward to staff of region
-    staff_list = STAFF_BY_REGION.get(region_ru, [])
-    for chat_id in staff_list:
-        try:
-            await message.bot.send_message(chat_id=chat_id, text=ticket_text)
-        except Exception as e:
-            logging.exception("Failed to send ticket to %s: %s", chat_id, e)
+    # Persist for the staff of the region; OutboxWorker delivers in the background.
+    staff_list = snap.catalog.staff_by_region.get(region_ru, ())
+    if not staff_list:
+        logging.error("No staff chats configured for region %s", region_ru)
+    # Urgent tickets bypass the digest window and go out on their own right away.
+    hold = 0.0 if urgent else DIGEST_WINDOW
+    await outbox.enqueue(idem_key, staff_list, ticket_text, hold=hold)
 
-    await message.answer(t(uid, "ticket_submitted"), reply_markup=main_menu_kb(lang))
+    await message.answer(snap.texts[lang].ticket_submitted, reply_markup=snap.keyboards.main_menu(lang))
     await state.update_data(_submitted=True)
     await state.set_state(ServiceForm.submitted)
 
 
+# ========================= STAFF =========================
+# Registered before the user router, so staff commands never reach main_handler.
+staff_router = Router()
+
+TICKETS_PAGE_SIZE = 10
+_COMMAND_ARG = re.compile(r"(\w+)=(.+?)(?=\s+\w+=|$)")
+
+
+def parse_command_args(args: Optional[str]) -> Dict[str, str]:
+    """`key=value` pairs; values may contain spaces (`region=Ташкент город`)."""
+    return {key: value.strip() for key, value in _COMMAND_ARG.findall(args or "")}
+
+
+def is_staff_chat(event: Union[Message, CallbackQuery]) -> bool:
+    message = event.message if isinstance(event, CallbackQuery) else event
+    return message is not None and message.chat.id in current().staff_chats
+
+
+def _find_region(snap: Snapshot, text: str) -> str:
+    route = snap.routes.get(text)
+    if route is not None and route.action == "region":
+        return route.key
+    folded = text.casefold()
+    for region in snap.catalog.regions:
+        if folded in (region.casefold(), *(snap.label(lang, region).casefold() for lang in snap.catalog.languages)):
+            return region
+    return text
+
+
+def parse_ticket_filter(snap: Snapshot, args: Optional[str]) -> TicketFilter:
+    """`region=Фергана status=new phone=+998 90 123 45 67`, any subset, any order.
+
+    Raises ValueError for a status outside tickets.STATUSES.
+    """
+    values = parse_command_args(args)
+    region = _find_region(snap, values["region"]) if values.get("region") else None
+    status = values.get("status") or None
+    if status is not None and status not in STATUSES:
+        raise ValueError(status)
+    # E.164 numbers have at most 15 digits; this also keeps the page callback short
+    phone = normalize_phone(values["phone"])[:15] if values.get("phone") else None
+    return TicketFilter(region=region, status=status, phone=phone or None)
+
+
+def _page_callback(snap: Snapshot, flt: TicketFilter, before: Optional[int]) -> str:
+    # Callback data is capped at 64 bytes: region and status travel as indexes, the phone
+    # as at most 15 digits, so the longest is about 45 bytes and never contains a ':'
+    regions = snap.catalog.regions
+    region = str(regions.index(flt.region)) if flt.region in regions else ""
+    status = str(STATUSES.index(flt.status)) if flt.status in STATUSES else ""
+    return f"tk:{before or ''}:{region}:{status}:{flt.phone or ''}"
+
+
+def _parse_page_callback(snap: Snapshot, data: str) -> Tuple[TicketFilter, Optional[int]]:
+    _, before, region, status, phone = data.split(":", 4)
+    regions = snap.catalog.regions
+    region_name = regions[int(region)] if region.isdigit() and int(region) < len(regions) else None
+    status_name = STATUSES[int(status)] if status.isdigit() and int(status) < len(STATUSES) else None
+    flt = TicketFilter(region=region_name, status=status_name, phone=phone if phone.isdigit() else None)
+    return flt, int(before) if before.isdigit() else None
+
+
+def format_ticket_line(ticket: Ticket) -> str:
+    when = time.strftime("%d.%m %H:%M", time.localtime(ticket.created_at))
+    flags = ("🚨" if ticket.urgent else "") + (f" ♻️#{ticket.duplicate_of}" if ticket.duplicate_of else "")
+    return f"#{ticket.id} {when} · {ticket.region} · {ticket.appliance} · +{ticket.phone_norm} · {ticket.status}{flags}"
+
+
+async def render_tickets_page(snap: Snapshot, flt: TicketFilter, before: Optional[int]) -> Tuple[str, InlineKeyboardMarkup]:
+    page = await tickets.page(flt, before=before, limit=TICKETS_PAGE_SIZE)
+    active = ", ".join(f"{k}={v}" for k, v in flt._asdict().items() if v)
+    lines = [f"🗂 Заявки{f' ({active})' if active else ''}:"]
+    lines += [format_ticket_line(ticket) for ticket in page] or ["— нет заявок —"]
+    buttons = []
+    if before is not None:
+        buttons.append(InlineKeyboardButton(text="⏮ Новые", callback_data=_page_callback(snap, flt, None)))
+    if len(page) == TICKETS_PAGE_SIZE:
+        buttons.append(InlineKeyboardButton(text="Дальше ▶", callback_data=_page_callback(snap, flt, page[-1].id)))
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=[buttons] if buttons else [])
+
+
+@staff_router.message(Command("tickets"), is_staff_chat)
+async def staff_tickets(message: Message, command: CommandObject):
+    snap = current()
+    try:
+        flt = parse_ticket_filter(snap, command.args)
+    except ValueError as e:
+        await message.answer(f"Неизвестный статус {e}; есть: {', '.join(STATUSES)}")
+        return
+    text, markup = await render_tickets_page(snap, flt, None)
+    await message.answer(text, reply_markup=markup)
+
+
+@staff_router.message(Command("ticket_status"), is_staff_chat)
+async def staff_ticket_status(message: Message, command: CommandObject):
+    """`/ticket_status 123 done`: move a ticket along."""
+    parts = (command.args or "").split()
+    if len(parts) != 2 or not parts[0].lstrip("#").isdigit() or parts[1] not in STATUSES:
+        await message.answer(f"/ticket_status <номер> <{'|'.join(STATUSES)}>")
+        return
+    ticket = await tickets.set_status(int(parts[0].lstrip("#")), parts[1])
+    await message.answer(format_ticket_line(ticket) if ticket else f"Заявки #{parts[0].lstrip('#')} нет")
+
+
+@staff_router.callback_query(F.data.startswith("tk:"), is_staff_chat)
+async def staff_tickets_page(callback: CallbackQuery):
+    await callback.answer()
+    snap = current()
+    flt, before = _parse_page_callback(snap, callback.data)
+    text, markup = await render_tickets_page(snap, flt, before)
+    await edit_or_answer(callback.message, text, markup)
+
+
+@staff_router.message(Command("export"), is_staff_chat)
+async def staff_export(message: Message, command: CommandObject):
+    """`/export from=2026-10-01 to=2026-10-07 region=Фергана lang=uz format=jsonl`, all optional."""
+    import tempfile
+
+    from export import FORMATS, date_range, export_tickets
+
+    snap = current()
+    values = parse_command_args(command.args)
+    fmt = values.get("format", "csv")
+    lang = values.get("lang", BASE_LANG)
+    if fmt not in FORMATS or lang not in snap.i18n:
+        await message.answer(f"format: {', '.join(FORMATS)}; lang: {', '.join(snap.catalog.languages)}")
+        return
+    try:
+        since, until = date_range(values.get("from"), values.get("to"))
+    except ValueError:
+        await message.answer("from/to: YYYY-MM-DD")
+        return
+    region = _find_region(snap, values["region"]) if values.get("region") else None
+
+    name = f"tickets_{date.fromtimestamp(since)}_{date.fromtimestamp(until - 1)}{FORMATS[fmt]}"
+    DATA_DIR.mkdir(parents=True, exist_ok=True)  # a fresh deploy may not have written anything yet
+    fd, tmp = tempfile.mkstemp(suffix=FORMATS[fmt], dir=DATA_DIR)
+    os.close(fd)
+    try:
+        # A big export is blocking I/O; keep it off the event loop
+        count = await asyncio.to_thread(
+            export_tickets, TICKETS_PATH, Path(tmp), snap.catalog, fmt, lang, since, until, region
+        )
+        await message.answer_document(FSInputFile(tmp, filename=name), caption=f"🗂 {count}")
+    finally:
+        os.unlink(tmp)
+
+
+_BROADCAST_STATUS = {"running": "идёт", "paused": "на паузе", "done": "завершена", "cancelled": "отменена"}
+
+
+def parse_broadcast_texts(snap: Snapshot, body: str) -> Dict[str, str]:
+    """One text for everyone, or a section per language starting with `ru:` / `uz:` on its own line."""
+    marker = re.compile(rf"^({'|'.join(map(re.escape, snap.catalog.languages))}):[ \t]*", re.M)
+    parts = marker.split(body.strip())
+    if len(parts) == 1:
+        return {BASE_LANG: parts[0]} if parts[0] else {}
+    texts = {lang: text.strip() for lang, text in zip(parts[1::2], parts[2::2]) if text.strip()}
+    if parts[0].strip():
+        texts.setdefault(BASE_LANG, parts[0].strip())
+    return texts
+
+
+def broadcast_status_text(job: Broadcast) -> str:
+    percent = min(100, 100 * job.handled // job.total) if job.total else 100
+    return (
+        f"📣 Рассылка #{job.id}: {_BROADCAST_STATUS.get(job.status, job.status)}, {job.handled}/{job.total} ({percent}%)\n"
+        f"✅ доставлено {job.sent} · 🚫 заблокировали {job.blocked} · ⚠️ ошибок {job.failed}"
+    )
+
+
+@staff_router.message(Command("broadcast"), is_staff_chat)
+async def staff_broadcast(message: Message):
+    """`/broadcast` + text, or `ru: …` and `uz: …` on separate lines; formatting is kept."""
+    snap = current()
+    # html_text keeps bold/links the way the staff member typed them
+    parts = message.html_text.split(maxsplit=1)
+    texts = parse_broadcast_texts(snap, parts[1] if len(parts) > 1 else "")
+    if BASE_LANG not in texts:
+        await message.answer(f"/broadcast текст — или по строке на язык: {', '.join(f'{lang}: …' for lang in snap.catalog.languages)}")
+        return
+    # The previews double as validation: Telegram rejects broken markup or overlong text here
+    for lang, text in texts.items():
+        try:
+            await message.answer(text)
+        except TelegramBadRequest as e:
+            await message.answer(f"❌ {lang}: {e.message}", parse_mode=None)
+            return
+    job, created = await broadcasts.create(texts, message.from_user.id if message.from_user else None)
+    if not created:
+        await message.answer(broadcast_status_text(job) + "\nСначала /broadcast_resume или /broadcast_cancel")
+        return
+    broadcaster.wake()
+    await message.answer(broadcast_status_text(job) + "\n/broadcast_pause · /broadcast_status")
+
+
+def _job_id(command: CommandObject) -> Optional[int]:
+    args = (command.args or "").strip().lstrip("#")
+    return int(args) if args.isdigit() else None
+
+
+@staff_router.message(Command("broadcast_status"), is_staff_chat)
+async def staff_broadcast_status(message: Message, command: CommandObject):
+    job = await broadcasts.get(_job_id(command))
+    await message.answer(broadcast_status_text(job) if job else "Рассылок ещё не было")
+
+
+@staff_router.message(Command("broadcast_pause", "broadcast_resume", "broadcast_cancel"), is_staff_chat)
+async def staff_broadcast_control(message: Message, command: CommandObject):
+    """`/broadcast_pause [id]` etc.; without an id, the latest broadcast."""
+    transitions = {
+        "broadcast_pause": (("running",), "paused"),
+        "broadcast_resume": (("paused",), "running"),
+        "broadcast_cancel": (("running", "paused"), "cancelled"),
+    }
+    from_status, to_status = transitions[command.command]
+    job = await broadcasts.transition(_job_id(command), from_status, to_status)
+    if job is None:
+        latest = await broadcasts.get(_job_id(command))
+        await message.answer(broadcast_status_text(latest) if latest else "Рассылок ещё не было")
+        return
+    if to_status == "running":
+        broadcaster.wake()
+    # A page already being sent still finishes; the status shows where it stopped
+    await message.answer(broadcast_status_text(job))
+
+
 # ========================= BOOT =========================
-async def on_startup(bot: Bot):
-    me = await bot.get_me()
+_outbox_worker: Optional[OutboxWorker] = None
+_metrics_runner: Optional["web.AppRunner"] = None
+
+
+def webhook_secret() -> str:
+    from webhook import derive_secret
+
+    return WEBHOOK_SECRET or derive_secret(BOT_TOKEN)
+
+
+async def _announce(bot: Bot) -> None:
+    me = await refresh_me(BOT_ME_PATH, bot)
     logging.info("Bot started as @%s (%s)", me.username, me.id)
 
 
+async def _in_background(coro, what: str) -> None:
+    try:
+        await coro
+    except Exception:
+        logging.exception("%s failed", what)
+
+
+async def on_startup(bot: Bot, dispatcher: Dispatcher):
+    # Everything here delays the first reply after a cold start, so only what updates
+    # depend on is awaited; the rest runs in the background. Timings → boot_timer.report()
+    global _outbox_worker, _metrics_runner
+    if METRICS_PORT:
+        _metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT + WORKER_INDEX)
+        boot_timer.mark("metrics")
+    # Only polling needs bot.me() before the first update; a cached copy (or any other
+    # mode) lets getMe run in the background
+    if use_cached_me(BOT_ME_PATH, bot) or BOT_MODE != "polling":
+        spawn(_in_background(_announce(bot), "getMe"))
+    else:
+        await _announce(bot)
+    boot_timer.mark("get_me")
+    if BOT_MODE == "webhook":
+        # The webhook is normally already set (that is what woke us); re-registering it
+        # must not keep the port closed
+        spawn(_in_background(
+            bot.set_webhook(
+                url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=webhook_secret(),
+                allowed_updates=dispatcher.resolve_used_update_types(),
+            ),
+            "setWebhook",
+        ))
+    elif BOT_MODE == "polling":
+        # getUpdates is refused while a webhook is set (e.g. after switching modes)
+        await bot.delete_webhook()
+        boot_timer.mark("delete_webhook")
+    # In multi-process mode the supervisor owns intake; worker 0 owns the shared jobs
+    lead = WORKER_INDEX == 0
+    media_cache.load()
+    if lead and MEDIA_WARMUP_CHAT_ID:
+        images = [IMAGES_DIR / f"{kind}_{lang}.jpg" for kind in ("brand", "warranty") for lang in current().catalog.languages]
+        spawn(media_cache.warm(bot, images, chat_id=MEDIA_WARMUP_CHAT_ID))
+    if BOT_MODE == "worker":
+        # Replies from every process slow the lead's broadcast down, not just the lead's own
+        spawn(traffic.run(broadcaster.bucket if lead else None))
+        if not lead:
+            spawn(broadcasts.watch_blocked())
+    if CATALOG_RELOAD_INTERVAL > 0:
+        # Every process watches on its own; each swaps in its own compiled snapshot
+        spawn(CatalogWatcher(CATALOG_PATH, apply_catalog, interval=CATALOG_RELOAD_INTERVAL).run())
+    if lead:
+        # Other workers enqueue into the same file without waking us → poll more often
+        _outbox_worker = OutboxWorker(outbox, get_fanout(bot), poll_interval=1.0 if BOT_MODE == "worker" else 5.0)
+        spawn(_outbox_worker.run())
+        # Users known from before the registry existed; only does work the first time
+        spawn(_in_background(broadcasts.import_users([
+            (STORAGE_PATH, "SELECT user_id, lang FROM user_lang"),
+            (TICKETS_PATH, "SELECT DISTINCT user_id, lang FROM tickets"),
+        ]), "User registry import"))
+        # Resumes an unfinished broadcast from its last checkpoint
+        spawn(broadcaster.run(bot))
+    boot_timer.mark("startup")
+    boot_timer.report()
+
+
+async def on_shutdown():
+    await broadcaster.stop()
+    for task in list(_background_tasks):
+        task.cancel()
+    if _outbox_worker is not None:
+        await _outbox_worker.stop()
+    await outbox.close()
+    await tickets.close()
+    await broadcasts.close()
+    await media_cache.flush()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+
+
+def create_bot() -> Bot:
+    session = PreparedMarkupSession(SessionProfile.from_env())
+    session.middleware(RequestMetricsMiddleware())
+    session.middleware(InteractiveTrafficMiddleware(broadcaster.bucket, traffic))
+    return CachedMeBot(
+        token=BOT_TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+
+
+def create_dispatcher() -> Dispatcher:
+    # FSM is registered by hand so flood protection runs before any storage access,
+    # and inside the per-user queue so state reads and writes of one user never interleave
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    dp.update.outer_middleware(ThrottleMiddleware(THROTTLE_RATE, THROTTLE_BURST, DEDUP_WINDOW))
+    if executor is not None:
+        dp.update.outer_middleware(executor)
+        # Queued updates still need the FSM storage that the dispatcher's own shutdown
+        # hook closes, so they are drained before it runs
+        dp.shutdown.handlers.insert(0, HandlerObject(callback=executor.close))
+    dp.update.outer_middleware(dp.fsm)
+    # Innermost, so it sees the first update only once its handler has finished
+    dp.update.outer_middleware(boot_timer)
+    registry = RegistryMiddleware(broadcasts, lambda user: user_language(current(), user))
+    dp.message.outer_middleware(registry)
+    dp.callback_query.outer_middleware(registry)
+    dp.include_router(staff_router)
+    dp.include_router(router)
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(HandlerMetricsMiddleware())
+        observer.middleware(LogContextMiddleware())
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+def check_data_dir() -> None:
+    """Complain when state would live on a throwaway filesystem (e.g. Render without a disk).
+
+    Everything under DATA_DIR (FSM sessions, outbox, tickets, user registry,
+    media/getMe caches) is lost on every redeploy unless it sits on a mounted disk.
+    """
+    explicit = bool(os.getenv("DATA_DIR"))
+    mounted = any(os.path.ismount(p) for p in DATA_DIR.resolve().parents if p != Path("/")) or os.path.ismount(DATA_DIR)
+    if explicit and mounted:
+        return
+    if REQUIRE_PERSISTENT_DATA:
+        raise RuntimeError(f"DATA_DIR={DATA_DIR} is not on a mounted disk; refusing to start (REQUIRE_PERSISTENT_DATA=1).")
+    if os.getenv("RENDER"):
+        logging.warning(
+            "DATA_DIR=%s is not on a persistent disk: FSM state, queued tickets, the ticket archive "
+            "and the user registry are wiped on every deploy or restart. Attach a disk and set DATA_DIR.",
+            DATA_DIR,
+        )
+
+
+def configure_logging(**static) -> None:
+    setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_REPEAT_WINDOW, LOG_REPEAT_BURST, **static)
+
+
 async def main():
-    logging.basicConfig(level=logging.INFO)
+    configure_logging()
     if not BOT_TOKEN or BOT_TOKEN == "PUT_YOUR_TOKEN_HERE":
         raise RuntimeError("Please set BOT_TOKEN env var or edit BOT_TOKEN in the script.")
 
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(router)
-    await on_startup(bot)
-    await dp.start_polling(bot)
+    check_data_dir()
+    boot_timer.mark("module")
+    bot = create_bot()
+    dp = create_dispatcher()
+    boot_timer.mark("dispatcher")
+    if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+        raise RuntimeError("Webhook mode needs WEBHOOK_BASE_URL (or RENDER_EXTERNAL_URL).")
+    if WORKERS > 1:
+        webhook = None
+        if BOT_MODE == "webhook":
+            webhook = dict(
+                url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+                path=WEBHOOK_PATH,
+                secret=webhook_secret(),
+                host=WEB_HOST,
+                port=WEB_PORT,
+            )
+        from workers import run_supervisor
+
+        await run_supervisor(bot, WORKERS, dp.resolve_used_update_types(), webhook=webhook)
+    elif BOT_MODE == "webhook":
+        from webhook import run_webhook
+
+        await run_webhook(dp, bot, WEBHOOK_PATH, webhook_secret(), WEB_HOST, WEB_PORT)
+    else:
+        # With the executor every update returns at once; feeding them one by one keeps arrival order
+        await dp.start_polling(bot, handle_as_tasks=executor is None)
 
 
 if __name__ == "__main__":
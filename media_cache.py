@@ -0,0 +1,172 @@
+# media_cache.py
+# -*- coding: utf-8 -*-
+"""
+Telegram file_id cache for local images.
+
+The first time an image is sent it is uploaded as FSInputFile; Telegram returns a
+file_id which we remember (keyed by path + mtime + size) and reuse for every later
+send. The map is persisted as JSON so restarts don't re-upload, and entries are
+dropped automatically when the file on disk changes. Changes are written a moment
+later on a worker thread, several at once, never on the event loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+
+def _fingerprint(path: Path) -> Optional[str]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+class MediaCache:
+    # Telegram's wording when a file_id itself is no good (other bot token, expired)
+    FILE_ID_ERRORS = ("file identifier", "file reference", "file_id")
+
+    def __init__(self, store_path: Path, save_delay: float = 1.0):
+        self.store_path = Path(store_path)
+        self.save_delay = save_delay
+        # str(path) -> (fingerprint, file_id)
+        self._entries: Dict[str, Tuple[str, str]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._save_task: Optional[asyncio.Task] = None
+        self._dirty = False
+
+    def load(self) -> None:
+        try:
+            raw = json.loads(self.store_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning("Media cache %s unreadable, starting empty: %s", self.store_path, e)
+            return
+        for key, item in raw.items():
+            if isinstance(item, dict) and item.get("fp") and item.get("file_id"):
+                self._entries[key] = (item["fp"], item["file_id"])
+
+    def save(self) -> None:
+        data = {k: {"fp": fp, "file_id": fid} for k, (fp, fid) in self._entries.items()}
+        self._write(data)
+
+    def _write(self, data: Dict[str, Dict[str, str]]) -> None:
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        # A temp file of our own, so worker processes saving at once don't clobber each other's
+        fd, tmp = tempfile.mkstemp(prefix=self.store_path.name + ".", suffix=".tmp", dir=self.store_path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(json.dumps(data, ensure_ascii=False, indent=1))
+            os.replace(tmp, self.store_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _changed(self) -> None:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()  # no event loop to block
+            return
+        self._dirty = True
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is None and self._save_task is None:
+            self._timer = asyncio.get_running_loop().call_later(self.save_delay, self._start_save)
+
+    def _start_save(self) -> None:
+        self._timer = None
+        self._save_task = asyncio.ensure_future(self._save_async())
+
+    async def _save_async(self) -> None:
+        self._dirty = False
+        try:
+            data = {k: {"fp": fp, "file_id": fid} for k, (fp, fid) in self._entries.items()}
+            await asyncio.to_thread(self._write, data)
+        except Exception:
+            logging.exception("Media cache %s not saved", self.store_path)
+        finally:
+            self._save_task = None
+        if self._dirty:
+            # Changed while being written
+            self._schedule()
+
+    async def flush(self) -> None:
+        """Write pending changes now (at shutdown)."""
+        if self._save_task is not None:
+            await self._save_task
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._dirty:
+            await self._save_async()
+
+    def get(self, path: Path) -> Optional[str]:
+        key = str(path)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != _fingerprint(path):
+            # Image was replaced on disk → the old file_id shows the old picture
+            self.invalidate(path)
+            return None
+        return entry[1]
+
+    def put(self, path: Path, file_id: str) -> None:
+        fp = _fingerprint(path)
+        if fp is None:
+            return
+        self._entries[str(path)] = (fp, file_id)
+        self._changed()
+
+    def invalidate(self, path: Path) -> None:
+        if self._entries.pop(str(path), None) is not None:
+            self._changed()
+
+    async def answer_photo(self, message: Message, path: Path, **kwargs) -> Message:
+        """message.answer_photo() that reuses a cached file_id and records new uploads."""
+        file_id = self.get(path)
+        if file_id:
+            try:
+                return await message.answer_photo(photo=file_id, **kwargs)
+            except TelegramBadRequest as e:
+                # Only a bad file_id (another bot token, expired) is fixed by re-uploading;
+                # a bad caption or markup would fail the upload just the same
+                if not any(marker in e.message.lower() for marker in self.FILE_ID_ERRORS):
+                    raise
+                logging.warning("Cached file_id for %s rejected: %s", path, e)
+                self.invalidate(path)
+        sent = await message.answer_photo(photo=FSInputFile(str(path)), **kwargs)
+        if sent.photo:
+            self.put(path, sent.photo[-1].file_id)
+        return sent
+
+    async def warm(self, bot: Bot, paths: Iterable[Path], chat_id: Optional[int] = None) -> None:
+        """Load persisted ids, drop stale ones and (optionally) pre-upload missing images.
+
+        Pre-upload needs a chat to send to (e.g. a staff chat); the service message
+        is deleted right after Telegram has assigned the file_id.
+        """
+        self.load()
+        missing = [p for p in paths if p.exists() and self.get(p) is None]
+        if not missing or chat_id is None:
+            return
+        for path in missing:
+            try:
+                sent = await bot.send_photo(chat_id=chat_id, photo=FSInputFile(str(path)), disable_notification=True)
+                if sent.photo:
+                    self.put(path, sent.photo[-1].file_id)
+                await bot.delete_message(chat_id=chat_id, message_id=sent.message_id)
+            except Exception as e:
+                logging.warning("Media warm-up failed for %s: %s", path, e)
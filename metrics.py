@@ -0,0 +1,215 @@
+# metrics.py
+# -*- coding: utf-8 -*-
+"""
+In-process metrics exposed as Prometheus text.
+
+- HandlerMetricsMiddleware (inner dispatcher middleware): handler latency histogram
+  labelled by handler name and FSM state, plus handler errors.
+- RequestMetricsMiddleware (Bot session middleware): count and latency of every
+  outbound Bot API method, 429/RetryAfter and error counters.
+
+Recording is a dict lookup plus a bisect per event, cheap enough to keep on in
+production. `start_metrics_server()` serves GET /metrics on a local port.
+"""
+
+import logging
+import time
+from bisect import bisect_left
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+if TYPE_CHECKING:
+    from aiohttp import web  # the server is optional (METRICS_PORT); imported when it starts
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                bucket_labels = _labels(self.label_names, labels, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+handler_latency = REGISTRY.register(
+    Histogram("bot_handler_latency_seconds", "Handler latency", ("handler", "state"))
+)
+handler_errors = REGISTRY.register(
+    Counter("bot_handler_errors_total", "Exceptions raised by handlers", ("handler", "state"))
+)
+api_latency = REGISTRY.register(
+    Histogram("bot_api_request_latency_seconds", "Outbound Bot API request latency", ("method",))
+)
+api_requests = REGISTRY.register(
+    Counter("bot_api_requests_total", "Outbound Bot API requests", ("method", "result"))
+)
+api_retry_after = REGISTRY.register(
+    Counter("bot_api_retry_after_total", "429 / RetryAfter responses", ("method",))
+)
+updates_dropped = REGISTRY.register(
+    Counter("bot_updates_dropped_total", "Incoming updates dropped before handling", ("reason",))
+)
+update_queue_depth = REGISTRY.register(
+    Gauge("bot_update_queue_depth", "Updates waiting in per-user queues")
+)
+update_queue_users = REGISTRY.register(
+    Gauge("bot_update_queue_users", "Users with queued or running updates")
+)
+update_queue_wait = REGISTRY.register(
+    Histogram("bot_update_queue_wait_seconds", "Time an update waited in its user queue")
+)
+log_records_dropped = REGISTRY.register(
+    Counter("bot_log_records_dropped_total", "Log records dropped by the repeat limit or a full queue", ("reason",))
+)
+broadcast_messages = REGISTRY.register(
+    Counter("bot_broadcast_messages_total", "Broadcast messages by outcome", ("result",))
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Register as an inner middleware so the chosen handler is known."""
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        state = data.get("raw_state") or "-"
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handler_errors.inc(name, state)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - t0, name, state)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        t0 = time.perf_counter()
+        result = "ok"
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            result = "retry_after"
+            api_retry_after.inc(name)
+            raise
+        except Exception:
+            result = "error"
+            raise
+        finally:
+            api_latency.observe(time.perf_counter() - t0, name)
+            api_requests.inc(name, result)
+
+
+async def _metrics_view(request: "web.Request") -> "web.Response":
+    from aiohttp import web
+
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> "web.AppRunner":
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info("Metrics on http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,373 @@
+# outbox.py
+# -*- coding: utf-8 -*-
+"""
+Durable outbox for messages that must reach staff chats.
+
+Handlers call `Outbox.enqueue()` — one SQLite (WAL) transaction, i.e. one local
+fsync — and can confirm to the user right away. `OutboxWorker` drains due rows in
+the background and retries until Telegram accepts them (at-least-once). Each row is
+unique per (idempotency key, chat_id), so re-enqueueing the same ticket is a no-op,
+and whatever was pending when the process stopped is picked up on the next start.
+
+Digests: rows enqueued with `hold` wait up to that many seconds for more messages
+to the same chat, then go out together as one message (split at Telegram's 4096
+character limit; a single row over the limit goes out in several parts). A chat
+that collects `digest_size` held rows is flushed at once. Rows without `hold`
+(urgent tickets) are sent alone right away. A digest Telegram rejects outright is
+retried row by row, so one bad row only fails itself.
+"""
+
+import asyncio
+import logging
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, TypeVar
+
+from fanout import DeliveryResult, FanOutSender
+
+T = TypeVar("T")
+
+MESSAGE_LIMIT = 4096  # Telegram text limit, in UTF-16 code units
+DIGEST_SEPARATOR = "\n\n"
+DIGEST_HEADER = "🗂 Заявок: {count}\n\n"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | sent | failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    sent_at REAL,
+    message_id INTEGER,
+    error TEXT,
+    batch INTEGER NOT NULL DEFAULT 0,  -- 1 = may be merged into a digest
+    UNIQUE (idem_key, chat_id)
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_chat ON outbox (chat_id, status);
+"""
+
+
+@dataclass
+class OutboxItem:
+    id: int
+    idem_key: str
+    chat_id: int
+    text: str
+    attempts: int
+    batch: bool = False
+
+
+def _units(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _fitting_prefix(text: str, limit: int) -> int:
+    """How many characters of `text` fit into `limit` UTF-16 code units."""
+    units = 0
+    for i, ch in enumerate(text):
+        units += 2 if ord(ch) > 0xFFFF else 1
+        if units > limit:
+            return i
+    return len(text)
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Cut `text` into messages of at most `limit` units, at line or word breaks where possible.
+
+    Rows are HTML-escaped plain text, so the only markup to keep whole is an entity (`&lt;`).
+    """
+    parts = []
+    while _units(text) > limit:
+        cut = _fitting_prefix(text, limit)
+        for sep in ("\n", " "):
+            at = text.rfind(sep, 0, cut)
+            if at > cut // 2:
+                cut = at + 1
+                break
+        amp = text.rfind("&", 0, cut)
+        if amp > 0 and ";" not in text[amp:cut]:
+            cut = amp
+        parts.append(text[:cut])
+        text = text[cut:]
+    parts.append(text)
+    return parts
+
+
+def pack_digests(items: Sequence[OutboxItem], limit: int = MESSAGE_LIMIT) -> List[List[OutboxItem]]:
+    """Split rows into runs whose digest text fits into one message."""
+    budget = limit - _units(DIGEST_HEADER.format(count=len(items)))
+    chunks: List[List[OutboxItem]] = []
+    chunk: List[OutboxItem] = []
+    size = 0
+    for item in items:
+        extra = _units(item.text) + (_units(DIGEST_SEPARATOR) if chunk else 0)
+        if chunk and size + extra > budget:
+            chunks.append(chunk)
+            chunk, size = [], 0
+            extra = _units(item.text)
+        chunk.append(item)
+        size += extra
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def digest_text(items: Sequence[OutboxItem]) -> str:
+    if len(items) == 1:
+        return items[0].text
+    return DIGEST_HEADER.format(count=len(items)) + DIGEST_SEPARATOR.join(item.text for item in items)
+
+
+class Outbox:
+    """SQLite-backed queue. All DB work runs on one dedicated thread."""
+
+    def __init__(self, db_path: Path, digest_size: int = 10):
+        self.db_path = Path(db_path)
+        self.digest_size = digest_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="outbox")
+        self._conn: Optional[sqlite3.Connection] = None
+        self.on_enqueue: Optional[Callable[[], None]] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")  # commit == fsync
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+            if columns and "batch" not in columns:
+                # Files created before digests existed
+                conn.execute("ALTER TABLE outbox ADD COLUMN batch INTEGER NOT NULL DEFAULT 0")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._db()))
+
+    async def enqueue(self, idem_key: str, chat_ids: Iterable[int], text: str, hold: float = 0.0) -> int:
+        """Persist one message per chat; returns how many rows were new.
+
+        `hold` > 0 lets the message wait that long to be merged into a digest.
+        """
+        now = time.time()
+        chat_ids = list(chat_ids)
+        rows = [(idem_key, chat_id, text, now, now + hold, int(hold > 0)) for chat_id in chat_ids]
+
+        def write(db: sqlite3.Connection) -> int:
+            before = db.total_changes
+            db.execute("BEGIN IMMEDIATE")  # all chats in one transaction → one fsync
+            try:
+                db.executemany(
+                    "INSERT OR IGNORE INTO outbox (idem_key, chat_id, text, created_at, next_attempt_at, batch) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                if hold > 0:
+                    for chat_id in chat_ids:
+                        self._release_full_digest(db, chat_id, now)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return db.total_changes - before
+
+        added = await self._run(write)
+        if added and self.on_enqueue:
+            self.on_enqueue()
+        return added
+
+    def _release_full_digest(self, db: sqlite3.Connection, chat_id: int, now: float) -> None:
+        (held,) = db.execute(
+            "SELECT COUNT(*) FROM outbox WHERE chat_id = ? AND status = 'pending' AND batch = 1 AND attempts = 0 "
+            "AND next_attempt_at > ?",
+            (chat_id, now),
+        ).fetchone()
+        if held >= self.digest_size:
+            db.execute(
+                "UPDATE outbox SET next_attempt_at = ? "
+                "WHERE chat_id = ? AND status = 'pending' AND batch = 1 AND attempts = 0 AND next_attempt_at > ?",
+                (now, chat_id, now),
+            )
+
+    async def due(self, limit: int, exclude: Set[int]) -> List[OutboxItem]:
+        now = time.time()
+
+        def read(db: sqlite3.Connection) -> List[OutboxItem]:
+            cur = db.execute(
+                "SELECT id, idem_key, chat_id, text, attempts, batch FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (now, limit + len(exclude)),
+            )
+            return [OutboxItem(*row) for row in cur if row[0] not in exclude][:limit]
+
+        return await self._run(read)
+
+    async def digest_rows(self, chat_id: int, exclude: Set[int]) -> List[OutboxItem]:
+        """Every held row for `chat_id` that may go out now, the not yet due ones included.
+
+        Rows waiting for a retry are left alone until they are due.
+        """
+        now = time.time()
+
+        def read(db: sqlite3.Connection) -> List[OutboxItem]:
+            cur = db.execute(
+                "SELECT id, idem_key, chat_id, text, attempts, batch FROM outbox "
+                "WHERE chat_id = ? AND status = 'pending' AND batch = 1 AND (attempts = 0 OR next_attempt_at <= ?) "
+                "ORDER BY id LIMIT ?",
+                (chat_id, now, 10 * self.digest_size + len(exclude)),
+            )
+            return [OutboxItem(*row) for row in cur if row[0] not in exclude]
+
+        return await self._run(read)
+
+    async def mark_sent(self, item_ids: Sequence[int], message_id: Optional[int]) -> None:
+        now = time.time()
+        await self._run(
+            lambda db: db.executemany(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, message_id = ?, error = NULL WHERE id = ?",
+                [(now, message_id, item_id) for item_id in item_ids],
+            )
+        )
+
+    async def mark_failed(self, item_ids: Sequence[int], error: str, retry_at: Optional[float]) -> None:
+        """Record a failed attempt; `retry_at=None` gives up on the rows for good."""
+        if retry_at is None:
+            sql, args = (
+                "UPDATE outbox SET status = 'failed', attempts = attempts + 1, error = ? WHERE id = ?",
+                [(error, item_id) for item_id in item_ids],
+            )
+        else:
+            sql, args = (
+                "UPDATE outbox SET attempts = attempts + 1, error = ?, next_attempt_at = ? WHERE id = ?",
+                [(error, retry_at, item_id) for item_id in item_ids],
+            )
+        await self._run(lambda db: db.executemany(sql, args))
+
+    async def pending_count(self) -> int:
+        return await self._run(lambda db: db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0])
+
+    async def purge(self, older_than: float) -> int:
+        """Delete delivered rows created more than `older_than` seconds ago."""
+        cutoff = time.time() - older_than
+        return await self._run(
+            lambda db: db.execute("DELETE FROM outbox WHERE status = 'sent' AND created_at < ?", (cutoff,)).rowcount
+        )
+
+    async def close(self) -> None:
+        def close(db: sqlite3.Connection) -> None:
+            db.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await self._run(close)
+        self._executor.shutdown(wait=True)
+
+
+class OutboxWorker:
+    def __init__(
+        self,
+        outbox: Outbox,
+        sender: FanOutSender,
+        batch_size: int = 50,
+        poll_interval: float = 5.0,
+        max_attempts: int = 20,
+        max_backoff: float = 600.0,
+        keep_sent: float = 7 * 24 * 3600,
+    ):
+        self.outbox = outbox
+        self.sender = sender
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.keep_sent = keep_sent
+        self._wake = asyncio.Event()
+        self._inflight: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        outbox.on_enqueue = self._wake.set
+
+    async def _deliver(self, items: List[OutboxItem]) -> None:
+        """Send one row, or several rows for the same chat as one digest message."""
+        ids = [item.id for item in items]
+        first = items[0]
+        try:
+            result = await self._send_text(first.chat_id, digest_text(items))
+            if result.ok:
+                await self.outbox.mark_sent(ids, result.message_id)
+                return
+            if not result.retryable and len(items) > 1:
+                # Telegram refused the digest itself; find out which rows it objects to
+                logging.warning("Digest of %s rows → %s rejected (%s), sending them one by one", len(items), first.chat_id, result.error)
+                for item in items:
+                    await self._deliver([item])
+                return
+            attempts = max(item.attempts for item in items) + 1
+            if attempts >= self.max_attempts or not result.retryable:
+                logging.error("Outbox %s → %s gave up after %s attempts: %s", first.idem_key, first.chat_id, attempts, result.error)
+                await self.outbox.mark_failed(ids, result.error or "", None)
+            else:
+                delay = min(self.max_backoff, 5 * 2 ** attempts) * (0.5 + random.random() / 2)
+                await self.outbox.mark_failed(ids, result.error or "", time.time() + delay)
+        except Exception:
+            logging.exception("Outbox delivery of %s crashed", ids)
+        finally:
+            self._inflight.difference_update(ids)
+
+    async def _send_text(self, chat_id: int, text: str) -> DeliveryResult:
+        """One message, or several in a row when the text is over Telegram's limit.
+
+        The result is the first part's, or the first failure's; a retry sends every part again.
+        """
+        first: Optional[DeliveryResult] = None
+        for part in split_text(text):
+            result = await self.sender.send_one(chat_id, part)
+            if not result.ok:
+                return result
+            first = first or result
+        return first
+
+    async def _plan(self, due: List[OutboxItem]) -> List[List[OutboxItem]]:
+        """Group due rows into messages: alone, or as digests per chat."""
+        sends: List[List[OutboxItem]] = [[item] for item in due if not item.batch]
+        digest_chats: Dict[int, None] = dict.fromkeys(item.chat_id for item in due if item.batch)
+        for chat_id in digest_chats:
+            # A due row flushes everything its chat has collected so far
+            rows = await self.outbox.digest_rows(chat_id, self._inflight)
+            sends.extend(pack_digests(rows))
+        return sends
+
+    async def run(self) -> None:
+        last_purge = 0.0
+        while True:
+            self._wake.clear()
+            try:
+                for items in await self._plan(await self.outbox.due(self.batch_size, self._inflight)):
+                    self._inflight.update(item.id for item in items)
+                    task = asyncio.create_task(self._deliver(items))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                if time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    await self.outbox.purge(self.keep_sent)
+            except Exception:
+                logging.exception("Outbox worker iteration failed")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        """Let in-flight sends finish; rows not yet sent stay pending for the next start."""
+        if self._tasks:
+            await asyncio.wait(list(self._tasks), timeout=10)
@@ -0,0 +1,106 @@
+# search.py
+# -*- coding: utf-8 -*-
+"""
+In-memory product search for inline mode (`@bot конд`).
+
+Every product is indexed under its RU name and all its translations. Names and
+queries are folded into one Latin key (lowercase, Cyrillic transliterated,
+apostrophe variants dropped), so "конд", "kond" and "Konditsioner" meet in the
+same space. Matching, best first:
+- the whole name starts with the query
+- a word of the name starts with the query
+- trigram similarity above a threshold (tolerates a typo or two)
+
+Results are memoized per folded query, so a repeated query costs one dict lookup.
+The index is immutable and is rebuilt together with the catalog snapshot.
+"""
+
+import re
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+from catalog import Catalog
+
+_CYR_TO_LAT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "j",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "x", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+    # Uzbek Cyrillic
+    "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+}
+_FOLD = str.maketrans({**_CYR_TO_LAT, "ʻ": "", "‘": "", "’": "", "'": "", "`": "", "ʼ": ""})
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+
+
+def fold(text: str) -> str:
+    """Script-independent search key: 'Кондиционеры' and 'konditsionery' fold alike."""
+    return _NON_WORD.sub(" ", text.casefold().translate(_FOLD)).strip()
+
+
+def trigrams(key: str) -> FrozenSet[str]:
+    padded = f"  {key} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+class _Entry:
+    __slots__ = ("name", "key", "words", "grams")
+
+    def __init__(self, name: str, key: str):
+        self.name = name  # canonical RU product name
+        self.key = key
+        self.words = tuple(key.split())
+        self.grams = trigrams(key)
+
+
+class ProductIndex:
+    def __init__(self, names: Iterable[Tuple[str, Iterable[str]]], min_similarity: float = 0.45, cache_size: int = 2048):
+        """`names`: (canonical name, all its display variants) pairs."""
+        self._order: Dict[str, int] = {}
+        entries: List[_Entry] = []
+        for name, variants in names:
+            self._order.setdefault(name, len(self._order))
+            for key in {fold(v) for v in variants} - {""}:
+                entries.append(_Entry(name, key))
+        self._entries = tuple(entries)
+        self.min_similarity = min_similarity
+        self._cache: "OrderedDict[str, Tuple[str, ...]]" = OrderedDict()
+        self._cache_size = cache_size
+
+    @classmethod
+    def from_catalog(cls, cat: Catalog) -> "ProductIndex":
+        return cls((name, [name, *(cat.label(lang, name) for lang in cat.languages)]) for name in cat.appliances)
+
+    def search(self, query: str, limit: int = 20) -> Tuple[str, ...]:
+        """Canonical names matching `query`, best first; an empty query lists all."""
+        key = fold(query)
+        hit = self._cache.get(key)
+        if hit is not None:
+            self._cache.move_to_end(key)
+            return hit[:limit]
+        result = self._search(key)
+        self._cache[key] = result
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return result[:limit]
+
+    def _search(self, key: str) -> Tuple[str, ...]:
+        if not key:
+            return tuple(self._order)
+        grams = trigrams(key)
+        best: Dict[str, float] = {}
+        for entry in self._entries:
+            if entry.key.startswith(key):
+                score = 3.0
+            elif any(word.startswith(key) for word in entry.words):
+                score = 2.0
+            else:
+                # Share of the query's trigrams found in the name: a short query
+                # against a long name is not penalized for the name's length
+                score = len(grams & entry.grams) / len(grams)
+                if score < self.min_similarity:
+                    continue
+            if score > best.get(entry.name, 0.0):
+                best[entry.name] = score
+        return tuple(sorted(best, key=lambda name: (-best[name], self._order[name])))
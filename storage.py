@@ -0,0 +1,276 @@
+# storage.py
+# -*- coding: utf-8 -*-
+"""
+SQLite-backed FSM storage and user language store.
+
+- Hot entries live in a bounded in-process LRU, so memory doesn't grow with users.
+- Writes are write-behind: they land in memory immediately and are flushed to
+  SQLite (WAL) in one transaction every `flush_interval` seconds and on close().
+  A hard crash can lose at most that window; a normal restart loses nothing.
+- Rows not touched for `ttl` seconds are deleted by a periodic sweep. Reading a
+  language counts as a touch; its `updated_at` is re-written at most once a day.
+
+Cache misses read the row synchronously on the event loop thread (a primary-key
+lookup in WAL mode doesn't wait for the writer); flushes run on a dedicated thread.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fsm_updated ON fsm (updated_at);
+CREATE TABLE IF NOT EXISTS user_lang (
+    user_id INTEGER PRIMARY KEY,
+    lang TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS user_lang_updated ON user_lang (updated_at);
+"""
+
+_MISSING = object()
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class _LRU(OrderedDict):
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get_fresh(self, key, default=_MISSING):
+        try:
+            self.move_to_end(key)
+        except KeyError:
+            return default
+        return self[key]
+
+    def put(self, key, value) -> None:
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class _WriteBehind:
+    """Shared SQLite file + batched writer for the FSM and language tables."""
+
+    def __init__(self, path: Path, flush_interval: float, ttl: float, lang_ttl: float):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.lang_ttl = lang_ttl
+        self._reader: Optional[sqlite3.Connection] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        self._writer: Optional[sqlite3.Connection] = None
+        # (table, key) -> row tuple, or None to delete
+        self.pending: Dict[Tuple[str, Any], Optional[tuple]] = {}
+        self.flushing: Dict[Tuple[str, Any], Optional[tuple]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+
+    @property
+    def reader(self) -> sqlite3.Connection:
+        if self._reader is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._reader = _connect(self.path)
+            self._reader.executescript(SCHEMA)
+        return self._reader
+
+    def lookup_pending(self, table: str, key: Any):
+        """Row not yet on disk: tuple, None (deleted) or _MISSING."""
+        item = (table, key)
+        if item in self.pending:
+            return self.pending[item]
+        return self.flushing.get(item, _MISSING)
+
+    def write(self, table: str, key: Any, row: Optional[tuple]) -> None:
+        self.pending[(table, key)] = row
+        if self._timer is None and self._flush_task is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # no loop (scripts/tests): close() flushes
+            self._timer = loop.call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._timer = None
+        self._flush_task = asyncio.ensure_future(self.flush())
+
+    def _apply(self, batch: Dict[Tuple[str, Any], Optional[tuple]], sweep: bool) -> None:
+        if self._writer is None:
+            self.reader  # make sure the schema exists
+            self._writer = _connect(self.path)
+        db = self._writer
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for (table, key), row in batch.items():
+                if table == "fsm":
+                    if row is None:
+                        db.execute("DELETE FROM fsm WHERE key = ?", (key,))
+                    else:
+                        db.execute("INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)", (key, *row))
+                else:
+                    db.execute("INSERT OR REPLACE INTO user_lang (user_id, lang, updated_at) VALUES (?, ?, ?)", (key, *row))
+            if sweep:
+                now = time.time()
+                db.execute("DELETE FROM fsm WHERE updated_at < ?", (now - self.ttl,))
+                db.execute("DELETE FROM user_lang WHERE updated_at < ?", (now - self.lang_ttl,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    async def flush(self) -> None:
+        try:
+            while self.pending:
+                self.flushing, self.pending = self.pending, {}
+                sweep = time.monotonic() - self._last_sweep > 600
+                if sweep:
+                    self._last_sweep = time.monotonic()
+                loop = asyncio.get_running_loop()
+                try:
+                    await loop.run_in_executor(self._executor, self._apply, self.flushing, sweep)
+                except Exception:
+                    logging.exception("Storage flush failed, will retry")
+                    # Keep newer writes, put the failed batch back under them
+                    self.pending = {**self.flushing, **self.pending}
+                    self.flushing = {}
+                    await asyncio.sleep(self.flush_interval)
+                else:
+                    self.flushing = {}
+        finally:
+            self._flush_task = None
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is not None:
+            await self._flush_task
+        if self.pending:
+            self.flushing, self.pending = self.pending, {}
+            self._apply(self.flushing, sweep=False)
+            self.flushing = {}
+        self._executor.shutdown(wait=True)
+        for conn in (self._writer, self._reader):
+            if conn is not None:
+                conn.close()
+
+
+class UserLangStore:
+    """Dict-like `user_id -> 'ru'|'uz'` view over the user_lang table."""
+
+    TOUCH_INTERVAL = 24 * 3600  # re-stamp a row read this long after its last write
+
+    def __init__(self, backend: _WriteBehind, cache_size: int):
+        self._backend = backend
+        self._cache = _LRU(cache_size)  # user_id -> (lang, updated_at) or (None, 0)
+
+    def get(self, user_id: int, default: Optional[str] = None) -> Optional[str]:
+        record = self._cache.get_fresh(user_id)
+        if record is _MISSING:
+            row = self._backend.lookup_pending("user_lang", user_id)
+            if row is _MISSING:
+                row = self._backend.reader.execute(
+                    "SELECT lang, updated_at FROM user_lang WHERE user_id = ?", (user_id,)
+                ).fetchone()
+            record = (row[0], row[1]) if row else (None, 0.0)
+            self._cache.put(user_id, record)
+        lang, updated_at = record
+        if lang is None:
+            return default
+        # Active users must not age out of the sweep just because they never switch language
+        if time.time() - updated_at > self.TOUCH_INTERVAL:
+            self[user_id] = lang
+        return lang
+
+    def __getitem__(self, user_id: int) -> str:
+        lang = self.get(user_id)
+        if lang is None:
+            raise KeyError(user_id)
+        return lang
+
+    def __setitem__(self, user_id: int, lang: str) -> None:
+        now = time.time()
+        self._cache.put(user_id, (lang, now))
+        self._backend.write("user_lang", user_id, (lang, now))
+
+    def __contains__(self, user_id: int) -> bool:
+        return self.get(user_id) is not None
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(
+        self,
+        path: Path,
+        cache_size: int = 10_000,
+        flush_interval: float = 1.0,
+        ttl: float = 7 * 24 * 3600,
+        lang_ttl: float = 365 * 24 * 3600,
+    ):
+        self._backend = _WriteBehind(path, flush_interval, ttl, lang_ttl)
+        self._cache = _LRU(cache_size)  # key -> (state, data)
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.langs = UserLangStore(self._backend, cache_size)
+
+    def _load(self, key: StorageKey) -> Tuple[str, Optional[str], Dict[str, Any]]:
+        skey = self._key_builder.build(key)
+        record = self._cache.get_fresh(skey)
+        if record is _MISSING:
+            row = self._backend.lookup_pending("fsm", skey)
+            if row is _MISSING:
+                row = self._backend.reader.execute(
+                    "SELECT state, data, updated_at FROM fsm WHERE key = ?", (skey,)
+                ).fetchone()
+            if row and row[2] >= time.time() - self._backend.ttl:
+                record = (row[0], json.loads(row[1]))
+            else:
+                record = (None, {})
+            self._cache.put(skey, record)
+        return skey, record[0], record[1]
+
+    def _store(self, skey: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        self._cache.put(skey, (state, data))
+        if state is None and not data:
+            self._backend.write("fsm", skey, None)
+        else:
+            self._backend.write("fsm", skey, (state, json.dumps(data, ensure_ascii=False), time.time()))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey, _, data = self._load(key)
+        self._store(skey, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._load(key)[1]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        skey, state, _ = self._load(key)
+        self._store(skey, state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._load(key)[2].copy()
+
+    async def close(self) -> None:
+        await self._backend.close()
@@ -0,0 +1,103 @@
+# throttle.py
+# -*- coding: utf-8 -*-
+"""
+Per-user flood protection, applied before an update reaches FSM storage.
+
+Every user gets a token bucket (`rate` updates/s, bursts up to `burst`); an update
+without a token is dropped. Independently, a text or callback that repeats the
+user's previous one within `window` seconds (double taps, client resends) is
+dropped as a duplicate.
+
+Inline queries (one update per keystroke) and chosen inline results are not
+counted; typing a search must not use up the budget for the user's messages and
+buttons. A dropped button press is still answered, without text, so the client's
+loading spinner stops.
+
+Users live in an LRU of at most `max_users` entries, so memory stays bounded and
+each update costs a dict lookup and a move-to-end. An evicted user simply starts
+again with a full bucket.
+"""
+
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Update
+
+from metrics import updates_dropped
+
+
+class _UserSlot:
+    __slots__ = ("tokens", "updated", "last_key", "last_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.last_key: Optional[Hashable] = None
+        self.last_at = 0.0
+
+
+def _fingerprint(update: Update) -> Optional[Hashable]:
+    if update.message is not None and update.message.text is not None:
+        return "m", update.message.text
+    if update.callback_query is not None:
+        query = update.callback_query
+        return "c", query.data, query.message.message_id if query.message else None
+    return None
+
+
+class ThrottleMiddleware(BaseMiddleware):
+    """Outer update middleware; register it before the FSM middleware (see main.create_dispatcher)."""
+
+    EXEMPT = ("inline_query", "chosen_inline_result")
+
+    def __init__(self, rate: float = 1.0, burst: float = 5.0, window: float = 2.0, max_users: int = 50_000):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.max_users = max_users
+        self._users: "OrderedDict[int, _UserSlot]" = OrderedDict()
+
+    def allow(self, user_id: int, key: Optional[Hashable]) -> Optional[str]:
+        """None when the update may pass, else the reason it is dropped."""
+        now = time.monotonic()
+        slot = self._users.get(user_id)
+        if slot is None:
+            slot = self._users[user_id] = _UserSlot(self.burst, now)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+            slot.tokens = min(self.burst, slot.tokens + (now - slot.updated) * self.rate)
+            slot.updated = now
+
+        if key is not None and key == slot.last_key and now - slot.last_at < self.window:
+            return "duplicate"
+        if self.rate > 0:
+            if slot.tokens < 1:
+                return "throttled"
+            slot.tokens -= 1
+        if key is not None:
+            slot.last_key, slot.last_at = key, now
+        return None
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or event.event_type in self.EXEMPT:
+            return await handler(event, data)
+        reason = self.allow(user.id, _fingerprint(event))
+        if reason is not None:
+            updates_dropped.inc(reason)
+            if event.callback_query is not None:
+                with suppress(TelegramAPIError):
+                    await data["bot"].answer_callback_query(event.callback_query.id)
+            return None
+        return await handler(event, data)
@@ -0,0 +1,199 @@
+# tickets.py
+# -*- coding: utf-8 -*-
+"""
+Searchable store of submitted service tickets (SQLite, WAL).
+
+Every ticket is kept with its form data and a normalized phone number. Indexes:
+- (region, id), (status, id): filtered listings, newest first
+- (created_at): date ranges
+- (phone_norm, appliance, created_at): repeat-caller lookups and duplicate detection
+
+Listings use keyset pagination (`WHERE id < cursor ORDER BY id DESC LIMIT n`),
+so page 1000 costs the same as page 1. Like the outbox, all DB work runs on one
+dedicated thread.
+"""
+
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL UNIQUE,
+    created_at REAL NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    full_name TEXT,
+    lang TEXT,
+    appliance TEXT NOT NULL,
+    region TEXT NOT NULL,
+    problem TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    phone_norm TEXT NOT NULL,
+    address TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'new',
+    urgent INTEGER NOT NULL DEFAULT 0,
+    duplicate_of INTEGER
+);
+CREATE INDEX IF NOT EXISTS tickets_region ON tickets (region, id);
+CREATE INDEX IF NOT EXISTS tickets_status ON tickets (status, id);
+CREATE INDEX IF NOT EXISTS tickets_created ON tickets (created_at);
+CREATE INDEX IF NOT EXISTS tickets_phone ON tickets (phone_norm, appliance, created_at);
+"""
+
+# Staff move tickets along with /ticket_status; the order is also their callback encoding
+STATUSES = ("new", "in_progress", "done", "cancelled")
+
+COLUMNS = (
+    "id, created_at, user_id, username, full_name, lang, appliance, region, problem, "
+    "phone, phone_norm, address, status, urgent, duplicate_of"
+)
+
+
+def normalize_phone(phone: str) -> str:
+    """Digits only, with Uzbekistan's 998 prefix added to bare 9-digit numbers."""
+    digits = "".join(ch for ch in phone if ch.isdigit())
+    if len(digits) == 9:
+        digits = "998" + digits
+    return digits
+
+
+@dataclass
+class Ticket:
+    id: int
+    created_at: float
+    user_id: int
+    username: Optional[str]
+    full_name: Optional[str]
+    lang: Optional[str]
+    appliance: str
+    region: str
+    problem: str
+    phone: str
+    phone_norm: str
+    address: str
+    status: str
+    urgent: bool
+    duplicate_of: Optional[int]
+
+
+class TicketFilter(NamedTuple):
+    region: Optional[str] = None
+    status: Optional[str] = None
+    phone: Optional[str] = None  # normalized
+
+
+class TicketStore:
+    def __init__(self, db_path: Path, duplicate_window: float = 3 * 24 * 3600):
+        self.db_path = Path(db_path)
+        self.duplicate_window = duplicate_window
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tickets")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # the outbox row is the durable copy
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    async def _run(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(self._db()))
+
+    async def add(
+        self,
+        idem_key: str,
+        *,
+        user_id: int,
+        username: Optional[str],
+        full_name: Optional[str],
+        lang: Optional[str],
+        appliance: str,
+        region: str,
+        problem: str,
+        phone: str,
+        address: str,
+        urgent: bool = False,
+    ) -> Tuple[int, Optional[int]]:
+        """Save a ticket; returns (ticket id, id of the earlier ticket it repeats or None).
+
+        Saving the same `idem_key` again returns the existing ticket.
+        """
+        now = time.time()
+        phone_norm = normalize_phone(phone)
+
+        def write(db: sqlite3.Connection) -> Tuple[int, Optional[int]]:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT id, duplicate_of FROM tickets WHERE idem_key = ?", (idem_key,)).fetchone()
+                if row is None:
+                    earlier = db.execute(
+                        "SELECT id FROM tickets WHERE phone_norm = ? AND appliance = ? AND created_at >= ? "
+                        "ORDER BY created_at DESC LIMIT 1",
+                        (phone_norm, appliance, now - self.duplicate_window),
+                    ).fetchone()
+                    duplicate_of = earlier[0] if earlier else None
+                    cur = db.execute(
+                        "INSERT INTO tickets (idem_key, created_at, user_id, username, full_name, lang, appliance, "
+                        "region, problem, phone, phone_norm, address, urgent, duplicate_of) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (idem_key, now, user_id, username, full_name, lang, appliance, region, problem,
+                         phone, phone_norm, address, int(urgent), duplicate_of),
+                    )
+                    row = (cur.lastrowid, duplicate_of)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return row
+
+        return await self._run(write)
+
+    async def page(self, flt: TicketFilter, before: Optional[int] = None, limit: int = 10) -> List[Ticket]:
+        """Newest first; pass the last id of a page as `before` to get the next one."""
+        where, args = [], []
+        for column, value in (("region", flt.region), ("status", flt.status), ("phone_norm", flt.phone)):
+            if value:
+                where.append(f"{column} = ?")
+                args.append(value)
+        if before is not None:
+            where.append("id < ?")
+            args.append(before)
+        sql = f"SELECT {COLUMNS} FROM tickets"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        args.append(limit)
+        return await self._run(lambda db: [Ticket(*row) for row in db.execute(sql, args)])
+
+    async def set_status(self, ticket_id: int, status: str) -> Optional[Ticket]:
+        """Returns the updated ticket, or None when there is no such ticket."""
+        if status not in STATUSES:
+            raise ValueError(f"unknown ticket status {status!r}")
+
+        def write(db: sqlite3.Connection) -> Optional[Ticket]:
+            db.execute("UPDATE tickets SET status = ? WHERE id = ?", (status, ticket_id))
+            row = db.execute(f"SELECT {COLUMNS} FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+            return Ticket(*row) if row else None
+
+        return await self._run(write)
+
+    async def close(self) -> None:
+        def close(db: sqlite3.Connection) -> None:
+            db.close()
+            self._conn = None
+
+        if self._conn is not None:
+            await self._run(close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,56 @@
+# webhook.py
+# -*- coding: utf-8 -*-
+"""
+Webhook entry point (aiohttp) for running as a Render web service.
+
+Telegram POSTs updates to `path`; the request is acknowledged with 200 at once and
+the update is processed in the background. The secret token header is checked on
+every request. GET /healthz answers for Render's health check.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+_started_at = time.monotonic()
+
+
+def derive_secret(bot_token: str) -> str:
+    """Stable secret for the X-Telegram-Bot-Api-Secret-Token header (same on every instance)."""
+    return hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()[:48]
+
+
+async def healthz(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "uptime": round(time.monotonic() - _started_at, 1)})
+
+
+def build_app(dp: Dispatcher, bot: Bot, path: str, secret_token: str) -> web.Application:
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=True,
+    ).register(app, path=path)
+    # Runs dp.startup / dp.shutdown handlers with the app lifecycle
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, path: str, secret_token: str, host: str, port: int) -> None:
+    app = build_app(dp, bot, path, secret_token)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    logging.info("Webhook server listening on %s:%s%s", host, port, path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,259 @@
+# workers.py
+# -*- coding: utf-8 -*-
+"""
+Multi-process mode: one supervisor receiving updates, N worker processes handling them.
+
+- The supervisor gets updates (long polling or webhook) and routes each raw update
+  to a worker chosen by rendezvous hashing of the sender's user id, so all updates
+  of one user — and therefore their FSM state and language — stay in one process.
+- Workers run the normal Dispatcher via feed_raw_update and publish a heartbeat;
+  a worker that dies or stops beating is restarted with the same index.
+- resize(n) drains all workers (they flush storage on shutdown) and starts n new
+  ones. Rendezvous hashing only moves ~1/n of users when n changes, and the moved
+  users' state is picked up from the shared SQLite files.
+- Only worker 0 drains the ticket outbox, so tickets are never delivered twice.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing as mp
+import os
+import signal
+import time
+from typing import Any, Dict, List, Optional
+
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 30.0
+
+_USER_FIELDS = ("from", "user")
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """Sender of a raw update, whatever its type (message, callback_query, ...)."""
+    for key, payload in update.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        for field in _USER_FIELDS:
+            user = payload.get(field)
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+        chat = payload.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+def pick_worker(user_id: int, count: int) -> int:
+    """Rendezvous hashing: stable, and only ~1/count of users move when count changes."""
+    best, best_score = 0, b""
+    for index in range(count):
+        score = hashlib.blake2b(f"{user_id}:{index}".encode(), digest_size=8).digest()
+        if score > best_score:
+            best, best_score = index, score
+    return best
+
+
+# ========================= WORKER PROCESS =========================
+def _worker_entry(index: int, queue: "mp.Queue", heartbeat: "mp.Value") -> None:
+    # BOT_MODE and WORKER_INDEX come with the environment (see _Worker.start)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor decides when we stop
+    asyncio.run(_worker_loop(index, queue, heartbeat))
+
+
+async def _worker_loop(index: int, queue: "mp.Queue", heartbeat: "mp.Value") -> None:
+    # Imported here: the child builds its own bot, dispatcher and storage. With main.py
+    # as the entry point, spawn has already run it as __mp_main__, which registers
+    # itself as `main`, so this does not execute it again
+    import main
+
+    main.configure_logging(worker=index)
+    bot = main.create_bot()
+    dp = main.create_dispatcher()
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def beat():
+        while True:
+            heartbeat.value = time.time()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    beat_task = asyncio.create_task(beat())
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    logging.info("Worker %s ready", index)
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            task = asyncio.create_task(dp.feed_raw_update(bot, raw))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.wait(list(tasks), timeout=10)
+        beat_task.cancel()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+# ========================= SUPERVISOR =========================
+class _Worker:
+    def __init__(self, ctx, index: int):
+        self.index = index
+        self.queue = ctx.Queue()
+        self.heartbeat = ctx.Value("d", time.time())
+        self.process: Optional[mp.Process] = None
+
+    def start(self, ctx) -> None:
+        self.heartbeat.value = time.time()
+        self.process = ctx.Process(
+            target=_worker_entry, args=(self.index, self.queue, self.heartbeat), name=f"bot-worker-{self.index}"
+        )
+        # The child runs main.py before _worker_entry, and its config is read at import,
+        # so the worker's settings must already be in the environment it starts with
+        env = {"BOT_MODE": "worker", "WORKER_INDEX": str(self.index)}
+        saved = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        try:
+            self.process.start()
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+
+class Supervisor:
+    def __init__(self, count: int):
+        self.count = count
+        self._ctx = mp.get_context("spawn")
+        self._workers: List[_Worker] = []
+        self._routing = asyncio.Event()  # cleared while resizing; updates wait
+        self.restarts = 0
+
+    def start(self) -> None:
+        self._workers = [_Worker(self._ctx, i) for i in range(self.count)]
+        for w in self._workers:
+            w.start(self._ctx)
+        self._routing.set()
+        logging.info("Started %s workers", self.count)
+
+    async def dispatch(self, raw: Dict[str, Any]) -> None:
+        await self._routing.wait()
+        uid = update_user_id(raw)
+        index = pick_worker(uid if uid is not None else raw.get("update_id", 0), len(self._workers))
+        self._workers[index].queue.put(raw)
+
+    async def monitor(self) -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL * 5)
+            if not self._routing.is_set():
+                continue
+            now = time.time()
+            for w in self._workers:
+                proc = w.process
+                if proc is None:
+                    continue
+                if not proc.is_alive():
+                    logging.error("Worker %s exited with %s, restarting", w.index, proc.exitcode)
+                elif now - w.heartbeat.value > HEARTBEAT_TIMEOUT:
+                    logging.error("Worker %s missed heartbeats for %.0fs, restarting", w.index, now - w.heartbeat.value)
+                    proc.kill()
+                    await asyncio.get_running_loop().run_in_executor(None, proc.join, 5)
+                else:
+                    continue
+                self.restarts += 1
+                w.start(self._ctx)
+
+    async def _stop_all(self) -> None:
+        loop = asyncio.get_running_loop()
+        for w in self._workers:
+            w.queue.put(None)
+        for w in self._workers:
+            if w.process is not None:
+                await loop.run_in_executor(None, w.process.join, 30)
+                if w.process.is_alive():
+                    w.process.kill()
+
+    async def resize(self, count: int) -> None:
+        """Drain all workers, then start `count` new ones; incoming updates wait meanwhile."""
+        if count < 1 or count == len(self._workers):
+            return
+        logging.info("Resizing workers %s → %s", len(self._workers), count)
+        self._routing.clear()
+        await self._stop_all()
+        self.count = count
+        self.start()
+
+    async def stop(self) -> None:
+        self._routing.clear()
+        await self._stop_all()
+
+
+async def run_supervisor(bot, count: int, allowed_updates: List[str], webhook: Optional[dict] = None) -> None:
+    """Receive updates with `bot` and spread them over `count` worker processes.
+
+    `webhook` = {"url", "path", "secret", "host", "port"} selects webhook intake;
+    otherwise the supervisor long-polls getUpdates itself.
+    SIGUSR1 / SIGUSR2 add / remove one worker.
+    """
+    sup = Supervisor(count)
+    sup.start()
+    loop = asyncio.get_running_loop()
+    for sig, delta in ((getattr(signal, "SIGUSR1", None), 1), (getattr(signal, "SIGUSR2", None), -1)):
+        if sig is not None:
+            loop.add_signal_handler(sig, lambda d=delta: asyncio.ensure_future(sup.resize(sup.count + d)))
+    monitor = asyncio.create_task(sup.monitor())
+    try:
+        if webhook:
+            await _receive_webhook(bot, sup, allowed_updates, **webhook)
+        else:
+            await _receive_polling(bot, sup, allowed_updates)
+    finally:
+        monitor.cancel()
+        await sup.stop()
+        await bot.session.close()
+
+
+async def _receive_polling(bot, sup: Supervisor, allowed_updates: List[str]) -> None:
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.warning("getUpdates failed: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            await sup.dispatch(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+
+
+async def _receive_webhook(bot, sup: Supervisor, allowed_updates: List[str], url: str, path: str, secret: str, host: str, port: int) -> None:
+    import secrets as _secrets
+
+    from aiohttp import web
+
+    from webhook import healthz
+
+    async def handle(request: web.Request) -> web.Response:
+        if not _secrets.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret):
+            return web.Response(status=401)
+        await sup.dispatch(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/healthz", healthz)
+    app.router.add_post(path, handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    await bot.set_webhook(url=url, secret_token=secret, allowed_updates=allowed_updates)
+    logging.info("Supervisor webhook listening on %s:%s%s", host, port, path)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()